@@ -4,6 +4,8 @@ Clone of 2048 game.
 
 import poc_2048_gui        
 import random
+import collections
+import time
 # Directions, DO NOT MODIFY
 UP = 1
 DOWN = 2
@@ -48,6 +50,22 @@ def merge(line):
                     break    
     return initiallist
 
+def line_can_move(line):
+    """
+    Return True if merge(line) would change line, without building
+    the merged list
+    """
+    seen_empty = False
+    previous = 0
+    for value in line:
+        if value == 0:
+            seen_empty = True
+        else:
+            if seen_empty or value == previous:
+                return True
+            previous = value
+    return False
+
 class TwentyFortyEight:
     """
     Class to run the game logic.
@@ -61,12 +79,29 @@ class TwentyFortyEight:
            DOWN: [[self.row - 1, col] for col in range(self.column)], 
            LEFT: [[row, 0] for row in range(self.row)], 
            RIGHT: [[row, self.column - 1] for row in range(self.row)]} 
+        # cells of every row/column in the order move reads them
+        self._lines = {}
+        for direction in self.tiles:
+            self._lines[direction] = []
+            for item in self.tiles[direction]:
+                line = []
+                temprow = item[0]
+                tempcol = item[1]
+                while temprow < self.row and tempcol < self.column and temprow >= 0 and tempcol >= 0:
+                    line.append((temprow, tempcol))
+                    temprow += OFFSETS[direction][0]
+                    tempcol += OFFSETS[direction][1]
+                self._lines[direction].append(line)
     
     def reset(self):
         """
         Reset the game so the grid is empty.
         """
         self.grid = [ [0 for dummy_col in range(self.column)] for dummy_row in range(self.row)]
+        # free list of empty cells plus each cell's position in it, kept
+        # up to date by set_tile so new_tile never rescans the grid
+        self._empty = [(row, col) for row in range(self.row) for col in range(self.column)]
+        self._empty_index = dict([(cell, idx) for idx, cell in enumerate(self._empty)])
         return self.grid
     
     def __str__(self):
@@ -91,28 +126,37 @@ class TwentyFortyEight:
         """
         Move all tiles in the given direction and add
         a new tile if any tiles moved.
-        """
 
-        for item in self.tiles[direction]:
-            newlist = []
-            temprow = item[0]
-            tempcol = item[1]
-            while temprow < self.row and tempcol < self.column and temprow >= 0 and tempcol >= 0:
-                newlist.append(self.get_tile(temprow, tempcol))
-                temprow += OFFSETS[direction][0]
-                tempcol += OFFSETS[direction][1]
+        Returns True if any tile moved.
+        """
+        changed = False
+        for line in self._lines[direction]:
+            newlist = [self.grid[row][col] for row, col in line]
             merged = merge(newlist)
-            temprow = item[0]
-            tempcol = item[1]                        
-            #while temprow < self.row and tempcol < self.column and temprow >= 0 and tempcol >= 0:
-            for items in merged:                 
-                self.set_tile(temprow, tempcol, items)
-                temprow += OFFSETS[direction][0]
-                tempcol += OFFSETS[direction][1]
-                if temprow >= self.row or tempcol >= self.column or temprow < 0 or tempcol < 0:
-                    break
-        self.new_tile()
-                
+            if merged == newlist:
+                continue
+            changed = True
+            for cell, items in zip(line, merged):
+                if self.grid[cell[0]][cell[1]] != items:
+                    self.set_tile(cell[0], cell[1], items)
+        if changed:
+            self.new_tile()
+        return changed
+
+    def can_move(self, direction):
+        """
+        Return True if moving in the given direction would move a tile.
+        """
+        for line in self._lines[direction]:
+            if line_can_move([self.grid[row][col] for row, col in line]):
+                return True
+        return False
+
+    def legal_moves(self):
+        """
+        Return the list of directions that would move a tile.
+        """
+        return [direction for direction in (UP, DOWN, LEFT, RIGHT) if self.can_move(direction)]
         
     def new_tile(self):
         """
@@ -120,22 +164,41 @@ class TwentyFortyEight:
         square.  The tile should be 2 90% of the time and
         4 10% of the time.
         """
-        zerolist = []
-        for row in range(self.row):
-            for col in range(self.column):
-                if self.grid[row][col] == 0:
-                    zerolist.append([row, col])
-        if zerolist != []:
-            newele = random.randrange(0, len(zerolist))
-            srow = zerolist[newele][0]
-            scol = zerolist[newele][1]
-            self.grid[srow][scol] = random.choice([2,2,2,2,2,2,2,2,2,4])
+        if self._empty != []:
+            newele = random.randrange(0, len(self._empty))
+            srow, scol = self._empty[newele]
+            self.set_tile(srow, scol, random.choice([2,2,2,2,2,2,2,2,2,4]))
         
     def set_tile(self, row, col, value):
         """
         Set the tile at position row, col to have the given value.
         """        
+        old_value = self.grid[row][col]
         self.grid[row][col] = value
+        if old_value == 0 and value != 0:
+            # swap the last free cell into this one's slot
+            idx = self._empty_index.pop((row, col))
+            last = self._empty.pop()
+            if last != (row, col):
+                self._empty[idx] = last
+                self._empty_index[last] = idx
+        elif old_value != 0 and value == 0:
+            self._empty_index[(row, col)] = len(self._empty)
+            self._empty.append((row, col))
+
+    def num_empty(self):
+        """
+        Return the number of empty squares.
+        """
+        return len(self._empty)
+
+    def empty_cells(self):
+        """
+        Return a list of (row, col) for the empty squares, in no
+        particular order.  Only valid if the grid is changed through
+        set_tile, move and reset.
+        """
+        return list(self._empty)
 
     def get_tile(self, row, col):
         """
@@ -143,6 +206,860 @@ class TwentyFortyEight:
         """        
         # replace with your code
         return self.grid[row][col]
- 
-    
+
+
+# Bitboard engine for the 4x4 game.
+# Each cell is a 4-bit exponent (0 for empty, k for tile 2**k), cell
+# (row, col) lives at bits 16*row + 4*col, so a whole board fits in 64 bits
+# and each row is a 16-bit word.
+BOARD_SIZE = 4
+ROW_MASK = 0xFFFF
+MAX_EXPONENT = 15
+
+# Lookup tables from a 16-bit row to the row after moving it left/right,
+# built lazily because 65536 entries take a while in CodeSkulptor.
+ROW_LEFT_TABLE = []
+ROW_RIGHT_TABLE = []
+
+
+def tile_to_exponent(value):
+    """
+    Convert a tile value (0, 2, 4, ...) to its 4-bit exponent
+    """
+    exponent = 0
+    while value > 1:
+        value >>= 1
+        exponent += 1
+    return exponent
+
+
+def exponent_to_tile(exponent):
+    """
+    Convert a 4-bit exponent back to a tile value
+    """
+    if exponent == 0:
+        return 0
+    return 1 << exponent
+
+
+def unpack_row(row):
+    """
+    Return the list of tile values packed in a 16-bit row
+    """
+    return [exponent_to_tile((row >> (4 * col)) & 0xF) for col in range(BOARD_SIZE)]
+
+
+def pack_row(line):
+    """
+    Pack a list of tile values into a 16-bit row, saturating at 2**15
+    """
+    row = 0
+    for col in range(BOARD_SIZE):
+        row |= min(tile_to_exponent(line[col]), MAX_EXPONENT) << (4 * col)
+    return row
+
+
+def reverse_row(row):
+    """
+    Reverse the order of the four cells in a 16-bit row
+    """
+    return (((row & 0xF) << 12) | ((row & 0xF0) << 4) |
+            ((row >> 4) & 0xF0) | ((row >> 12) & 0xF))
+
+
+def build_move_tables():
+    """
+    Fill ROW_LEFT_TABLE and ROW_RIGHT_TABLE using merge() so the bitboard
+    engine has exactly the same rules as TwentyFortyEight
+    """
+    if ROW_LEFT_TABLE:
+        return
+    left_table = [0] * (ROW_MASK + 1)
+    right_table = [0] * (ROW_MASK + 1)
+    for row in range(ROW_MASK + 1):
+        left = pack_row(merge(unpack_row(row)))
+        left_table[row] = left
+        right_table[reverse_row(row)] = reverse_row(left)
+    ROW_LEFT_TABLE.extend(left_table)
+    ROW_RIGHT_TABLE.extend(right_table)
+
+
+def transpose_board(board):
+    """
+    Transpose a 64-bit board so that columns become rows
+    """
+    part1 = board & 0xF0F00F0FF0F00F0F
+    part2 = board & 0x0000F0F00000F0F0
+    part3 = board & 0x0F0F00000F0F0000
+    board = part1 | (part2 << 12) | (part3 >> 12)
+    part1 = board & 0xFF00FF0000FF00FF
+    part2 = board & 0x00FF00FF00000000
+    part3 = board & 0x00000000FF00FF00
+    return part1 | (part2 >> 24) | (part3 << 24)
+
+
+def grid_to_board(grid):
+    """
+    Pack a 4x4 list-of-lists grid into a 64-bit board
+    """
+    board = 0
+    for row in range(BOARD_SIZE):
+        board |= pack_row(grid[row]) << (16 * row)
+    return board
+
+
+def board_to_grid(board):
+    """
+    Unpack a 64-bit board into a 4x4 list-of-lists grid
+    """
+    return [unpack_row((board >> (16 * row)) & ROW_MASK) for row in range(BOARD_SIZE)]
+
+
+def move_board(board, direction):
+    """
+    Return the board after sliding all tiles in the given direction.
+    No new tile is added.
+    """
+    build_move_tables()
+    if direction == LEFT or direction == RIGHT:
+        table = ROW_LEFT_TABLE if direction == LEFT else ROW_RIGHT_TABLE
+        return (table[board & ROW_MASK] |
+                table[(board >> 16) & ROW_MASK] << 16 |
+                table[(board >> 32) & ROW_MASK] << 32 |
+                table[(board >> 48) & ROW_MASK] << 48)
+    # UP and DOWN are LEFT and RIGHT on the transposed board
+    if direction == UP:
+        return transpose_board(move_board(transpose_board(board), LEFT))
+    return transpose_board(move_board(transpose_board(board), RIGHT))
+
+
+def empty_positions(board):
+    """
+    Return the list of bit shifts of the empty cells of a board
+    """
+    return [shift for shift in range(0, 64, 4) if (board >> shift) & 0xF == 0]
+
+
+class BitboardTwentyFortyEight:
+    """
+    Drop-in replacement for TwentyFortyEight on a 4x4 grid that keeps
+    the board in a single 64-bit integer.
+    """
+
+    def __init__(self, grid_height=BOARD_SIZE, grid_width=BOARD_SIZE):
+        if grid_height != BOARD_SIZE or grid_width != BOARD_SIZE:
+            raise ValueError("bitboard engine only supports 4x4 grids")
+        self.row = grid_height
+        self.column = grid_width
+        build_move_tables()
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the game so the grid is empty.
+        """
+        self.board = 0
+
+    def __str__(self):
+        """
+        Return a string representation of the grid for debugging.
+        """
+        return str(board_to_grid(self.board))
+
+    def get_grid_height(self):
+        """
+        Get the height of the board.
+        """
+        return self.row
+
+    def get_grid_width(self):
+        """
+        Get the width of the board.
+        """
+        return self.column
+
+    def move(self, direction):
+        """
+        Move all tiles in the given direction and add
+        a new tile if any tiles moved.
+
+        Returns True if any tile moved.
+        """
+        moved = move_board(self.board, direction)
+        if moved == self.board:
+            return False
+        self.board = moved
+        self.new_tile()
+        return True
+
+    def can_move(self, direction):
+        """
+        Return True if moving in the given direction would move a tile.
+        """
+        return move_board(self.board, direction) != self.board
+
+    def legal_moves(self):
+        """
+        Return the list of directions that would move a tile.
+        """
+        return [direction for direction in (UP, DOWN, LEFT, RIGHT) if self.can_move(direction)]
+
+    def new_tile(self):
+        """
+        Create a new tile in a randomly selected empty
+        square.  The tile should be 2 90% of the time and
+        4 10% of the time.
+        """
+        zerolist = empty_positions(self.board)
+        if zerolist != []:
+            shift = zerolist[random.randrange(0, len(zerolist))]
+            self.board |= random.choice([1, 1, 1, 1, 1, 1, 1, 1, 1, 2]) << shift
+
+    def set_tile(self, row, col, value):
+        """
+        Set the tile at position row, col to have the given value.
+        """
+        shift = 16 * row + 4 * col
+        exponent = min(tile_to_exponent(value), MAX_EXPONENT)
+        self.board = (self.board & ~(0xF << shift)) | (exponent << shift)
+
+    def get_tile(self, row, col):
+        """
+        Return the value of the tile at position row, col.
+        """
+        return exponent_to_tile((self.board >> (16 * row + 4 * col)) & 0xF)
+
+    def num_empty(self):
+        """
+        Return the number of empty squares.
+        """
+        return len(empty_positions(self.board))
+
+    def empty_cells(self):
+        """
+        Return a list of (row, col) for the empty squares.
+        """
+        return [(shift // 16, (shift % 16) // 4) for shift in empty_positions(self.board)]
+
+
+# Expectimax player.
+# Heuristic weights for a single row or column of exponents.
+EMPTY_WEIGHT = 270.0
+MERGE_WEIGHT = 700.0
+MONOTONIC_WEIGHT = 47.0
+SUM_WEIGHT = 11.0
+HEURISTIC_BASE = 200000.0
+# Value of a position with no legal move.  Finite so that expected
+# values stay comparable, and far below any board evaluate can return.
+LOSS_VALUE = -1e18
+# Spawn distribution used by new_tile
+SPAWN_PROBABILITIES = ((2, 0.9), (4, 0.1))
+
+ROW_HEURISTIC_TABLE = []
+
+
+def line_heuristic(exponents):
+    """
+    Score a row or column given as a list of exponents, rewarding empty
+    cells, possible merges and monotonic rows
+    """
+    empty = 0
+    merges = 0
+    previous = 0
+    for exponent in exponents:
+        if exponent == 0:
+            empty += 1
+        elif exponent == previous:
+            merges += 1
+        if exponent != 0:
+            previous = exponent
+    mono_left = 0.0
+    mono_right = 0.0
+    for idx in range(1, len(exponents)):
+        left = exponents[idx - 1] ** 4
+        right = exponents[idx] ** 4
+        if left > right:
+            mono_left += left - right
+        else:
+            mono_right += right - left
+    total = sum([exponent ** 3.5 for exponent in exponents])
+    return (HEURISTIC_BASE / len(exponents) + EMPTY_WEIGHT * empty + MERGE_WEIGHT * merges -
+            MONOTONIC_WEIGHT * min(mono_left, mono_right) - SUM_WEIGHT * total)
+
+
+def build_heuristic_table():
+    """
+    Fill ROW_HEURISTIC_TABLE with line_heuristic for every 16-bit row
+    """
+    if ROW_HEURISTIC_TABLE:
+        return
+    ROW_HEURISTIC_TABLE.extend([line_heuristic([(row >> (4 * col)) & 0xF for col in range(BOARD_SIZE)])
+                                for row in range(ROW_MASK + 1)])
+
+
+class LRUCache:
+    """
+    Dictionary with a bounded size that evicts the least recently
+    used entry.
+    """
+
+    def __init__(self, capacity):
+        self._capacity = capacity
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Return the cached value for key, or None
+        """
+        value = self._entries.pop(key, None)
+        if value is not None:
+            self._entries[key] = value
+        return value
+
+    def put(self, key, value):
+        """
+        Store value for key, evicting the oldest entry if full
+        """
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        if len(self._entries) > self._capacity:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Drop every entry
+        """
+        self._entries.clear()
+
+
+class BitboardSearchSpace:
+    """
+    Move generation and evaluation for 4x4 boards packed into 64 bits.
+    Evaluations are memoized per board; the memo is dropped once it
+    holds eval_cache_size boards.
+    """
+
+    def __init__(self, eval_cache_size=1 << 20):
+        build_move_tables()
+        build_heuristic_table()
+        self._evaluated = {}
+        self._eval_cache_size = eval_cache_size
+
+    def moves(self, state):
+        """
+        Return (direction, state) for every move that changes the board
+        """
+        # move_board inlined, sharing one transpose between UP and DOWN
+        left_table = ROW_LEFT_TABLE
+        right_table = ROW_RIGHT_TABLE
+        result = []
+        transposed = transpose_board(state)
+        rows = [(transposed >> shift) & ROW_MASK for shift in (0, 16, 32, 48)]
+        for direction, table in ((UP, left_table), (DOWN, right_table)):
+            moved = (table[rows[0]] | table[rows[1]] << 16 |
+                     table[rows[2]] << 32 | table[rows[3]] << 48)
+            if moved != transposed:
+                result.append((direction, transpose_board(moved)))
+        rows = [(state >> shift) & ROW_MASK for shift in (0, 16, 32, 48)]
+        for direction, table in ((LEFT, left_table), (RIGHT, right_table)):
+            moved = (table[rows[0]] | table[rows[1]] << 16 |
+                     table[rows[2]] << 32 | table[rows[3]] << 48)
+            if moved != state:
+                result.append((direction, moved))
+        return result
+
+    def spawns(self, state):
+        """
+        Return a list with one [(probability, state), ...] entry per empty cell
+        """
+        return [[(probability, state | (tile_to_exponent(value) << shift))
+                 for value, probability in SPAWN_PROBABILITIES]
+                for shift in empty_positions(state)]
+
+    def evaluate(self, state):
+        """
+        Heuristic value of a board, summed over rows and columns
+        """
+        total = self._evaluated.get(state)
+        if total is not None:
+            return total
+        table = ROW_HEURISTIC_TABLE
+        transposed = transpose_board(state)
+        total = (table[state & ROW_MASK] + table[(state >> 16) & ROW_MASK] +
+                 table[(state >> 32) & ROW_MASK] + table[state >> 48] +
+                 table[transposed & ROW_MASK] + table[(transposed >> 16) & ROW_MASK] +
+                 table[(transposed >> 32) & ROW_MASK] + table[transposed >> 48])
+        if len(self._evaluated) >= self._eval_cache_size:
+            self._evaluated.clear()
+        self._evaluated[state] = total
+        return total
+
+
+class GridSearchSpace:
+    """
+    Move generation and evaluation for any board size, with the state
+    stored as a tuple of row tuples.
+    """
+
+    def __init__(self, grid_height, grid_width):
+        self._height = grid_height
+        self._width = grid_width
+        self._merge_cache = {}
+        self._heuristic_cache = {}
+
+    def _merge(self, line):
+        """
+        Memoized merge() on a tuple
+        """
+        merged = self._merge_cache.get(line)
+        if merged is None:
+            merged = tuple(merge(list(line)))
+            self._merge_cache[line] = merged
+        return merged
+
+    def slide(self, state, direction):
+        """
+        Return the state after sliding in the given direction
+        """
+        if direction == LEFT:
+            return tuple([self._merge(row) for row in state])
+        if direction == RIGHT:
+            return tuple([self._merge(row[::-1])[::-1] for row in state])
+        columns = zip(*state)
+        if direction == UP:
+            moved = [self._merge(col) for col in columns]
+        else:
+            moved = [self._merge(col[::-1])[::-1] for col in columns]
+        return tuple(zip(*moved))
+
+    def moves(self, state):
+        """
+        Return (direction, state) for every move that changes the board
+        """
+        result = []
+        for direction in (UP, DOWN, LEFT, RIGHT):
+            moved = self.slide(state, direction)
+            if moved != state:
+                result.append((direction, moved))
+        return result
+
+    def spawns(self, state):
+        """
+        Return a list with one [(probability, state), ...] entry per empty cell
+        """
+        result = []
+        for row in range(self._height):
+            for col in range(self._width):
+                if state[row][col] == 0:
+                    options = []
+                    for value, probability in SPAWN_PROBABILITIES:
+                        new_row = state[row][:col] + (value,) + state[row][col + 1:]
+                        options.append((probability, state[:row] + (new_row,) + state[row + 1:]))
+                    result.append(options)
+        return result
+
+    def _line_heuristic(self, line):
+        """
+        Memoized line_heuristic on a tuple of tile values
+        """
+        value = self._heuristic_cache.get(line)
+        if value is None:
+            value = line_heuristic([tile_to_exponent(tile) for tile in line])
+            self._heuristic_cache[line] = value
+        return value
+
+    def evaluate(self, state):
+        """
+        Heuristic value of a board, summed over rows and columns
+        """
+        total = 0.0
+        for row in state:
+            total += self._line_heuristic(row)
+        for col in zip(*state):
+            total += self._line_heuristic(col)
+        return total
+
+
+class ExpectimaxPlayer:
+    """
+    Choose moves for a TwentyFortyEight game by expectimax search over
+    the new_tile spawn distribution.  depth counts player moves; chance
+    nodes are cached in a bounded LRU transposition table keyed on
+    (state, depth) and pruned once their probability drops below
+    min_probability.  The defaults are the measured operating point on a
+    4x4 bitboard: about 170 moves/s, reaching 4096.  depth=3 with
+    min_probability=0.01 searches deeper at about 16 moves/s.
+    """
+
+    def __init__(self, depth=2, cache_size=200000, min_probability=0.05):
+        self._depth = depth
+        self._min_probability = min_probability
+        self._cache = LRUCache(cache_size)
+        self._bitboard_space = None
+        self._grid_spaces = {}
+
+    def _search_space(self, game):
+        """
+        Return (space, state) for the current position of game
+        """
+        if isinstance(game, BitboardTwentyFortyEight):
+            if self._bitboard_space is None:
+                self._bitboard_space = BitboardSearchSpace()
+            return self._bitboard_space, game.board
+        height = game.get_grid_height()
+        width = game.get_grid_width()
+        key = (height, width)
+        if key not in self._grid_spaces:
+            self._grid_spaces[key] = GridSearchSpace(height, width)
+        state = tuple([tuple([game.get_tile(row, col) for col in range(width)])
+                       for row in range(height)])
+        return self._grid_spaces[key], state
+
+    def get_move(self, game):
+        """
+        Return the best direction for game, or None if no move is possible
+        """
+        space, state = self._search_space(game)
+        best_direction = None
+        best_value = -float('inf')
+        for direction, moved in space.moves(state):
+            value = self._chance_value(space, moved, self._depth - 1, 1.0)
+            if value > best_value:
+                best_value = value
+                best_direction = direction
+        return best_direction
+
+    def _max_value(self, space, state, depth, probability):
+        """
+        Value of a position where the player is to move, LOSS_VALUE
+        if there is no legal move
+        """
+        best_value = LOSS_VALUE
+        for dummy_direction, moved in space.moves(state):
+            value = self._chance_value(space, moved, depth - 1, probability)
+            if value > best_value:
+                best_value = value
+        return best_value
+
+    def _chance_value(self, space, state, depth, probability):
+        """
+        Expected value of a position where a new tile is about to spawn
+        """
+        if depth < 0 or probability < self._min_probability:
+            return space.evaluate(state)
+        key = (state, depth)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        cells = space.spawns(state)
+        if cells == []:
+            return space.evaluate(state)
+        cell_probability = probability / len(cells)
+        total = 0.0
+        for options in cells:
+            for tile_probability, spawned in options:
+                total += tile_probability * self._max_value(space, spawned, depth,
+                                                            cell_probability * tile_probability)
+        value = total / len(cells)
+        self._cache.put(key, value)
+        return value
+
+    def clear_cache(self):
+        """
+        Drop the transposition table
+        """
+        self._cache.clear()
+
+# Batch simulator.
+def merge_score(line):
+    """
+    Return the points scored by merge(line), the sum of the new tiles
+    created by merging
+    """
+    points = 0
+    previous = 0
+    for value in line:
+        if value == 0:
+            continue
+        if value == previous:
+            points += 2 * value
+            previous = 0
+        else:
+            previous = value
+    return points
+
+
+def board_lines(grid_height, grid_width, direction):
+    """
+    Return, for a direction, the list of lines of a board as lists of
+    row-major cell offsets, ordered the way TwentyFortyEight.move reads them
+    """
+    if direction == UP:
+        starts = [(0, col) for col in range(grid_width)]
+    elif direction == DOWN:
+        starts = [(grid_height - 1, col) for col in range(grid_width)]
+    elif direction == LEFT:
+        starts = [(row, 0) for row in range(grid_height)]
+    else:
+        starts = [(row, grid_width - 1) for row in range(grid_height)]
+    lines = []
+    for start_row, start_col in starts:
+        line = []
+        row = start_row
+        col = start_col
+        while 0 <= row < grid_height and 0 <= col < grid_width:
+            line.append(row * grid_width + col)
+            row += OFFSETS[direction][0]
+            col += OFFSETS[direction][1]
+        lines.append(line)
+    return lines
+
+
+# BatchSimulator retires a board whose policy picks this many
+# directions in a row that do not move it
+MAX_STALLS = 64
+
+
+def random_policy(grid, rng):
+    """
+    Default BatchSimulator policy: pick a direction uniformly at random
+    """
+    return rng.choice((UP, DOWN, LEFT, RIGHT))
+
+
+class BatchSimulator:
+    """
+    Play many games of 2048 side by side.  All boards live in a single
+    flat list of num_boards * grid_height * grid_width cells and every
+    move is applied to all boards that picked the same direction, using
+    memoized merge() results per line.  Each board keeps the same free
+    list of empty cells as TwentyFortyEight, so a board driven with the
+    same directions and random stream matches the scalar game move for
+    move.
+    """
+
+    def __init__(self, num_boards, grid_height, grid_width, seed=None):
+        self._num_boards = num_boards
+        self._height = grid_height
+        self._width = grid_width
+        self._board_size = grid_height * grid_width
+        self._rng = random.Random(seed)
+        self._lines = dict([(direction, board_lines(grid_height, grid_width, direction))
+                            for direction in (UP, DOWN, LEFT, RIGHT)])
+        self._merge_cache = {}
+        self.reset()
+
+    def reset(self):
+        """
+        Clear every board and spawn two starting tiles on each
+        """
+        self.cells = [0] * (self._num_boards * self._board_size)
+        # per board: free list of empty cell offsets in TwentyFortyEight
+        # order, and each offset's position in it (-1 if occupied)
+        self._empty = [list(range(self._board_size)) for dummy_board in range(self._num_boards)]
+        self._empty_index = [list(range(self._board_size)) for dummy_board in range(self._num_boards)]
+        self.scores = [0] * self._num_boards
+        self.moves = [0] * self._num_boards
+        self.attempts = [0] * self._num_boards
+        self.stalls = [0] * self._num_boards
+        self.alive = [True] * self._num_boards
+        for board in range(self._num_boards):
+            self.new_tile(board)
+            self.new_tile(board)
+
+    def get_grid(self, board):
+        """
+        Return board as a list-of-lists grid
+        """
+        base = board * self._board_size
+        return [self.cells[base + row * self._width:base + (row + 1) * self._width]
+                for row in range(self._height)]
+
+    def new_tile(self, board):
+        """
+        Spawn a tile on board, drawing from this simulator's random
+        stream the way TwentyFortyEight.new_tile does: randrange over the
+        board's free list, then the 2/4 choice
+        """
+        empty = self._empty[board]
+        if empty != []:
+            newele = self._rng.randrange(0, len(empty))
+            self._set_cell(board, empty[newele], self._rng.choice([2, 2, 2, 2, 2, 2, 2, 2, 2, 4]))
+
+    def _set_cell(self, board, offset, value):
+        """
+        Set a cell of board and update its free list the way
+        TwentyFortyEight.set_tile does
+        """
+        idx = board * self._board_size + offset
+        old_value = self.cells[idx]
+        self.cells[idx] = value
+        empty = self._empty[board]
+        empty_index = self._empty_index[board]
+        if old_value == 0 and value != 0:
+            # swap the last free cell into this one's slot
+            pos = empty_index[offset]
+            empty_index[offset] = -1
+            last = empty.pop()
+            if last != offset:
+                empty[pos] = last
+                empty_index[last] = pos
+        elif old_value != 0 and value == 0:
+            empty_index[offset] = len(empty)
+            empty.append(offset)
+
+    def _merge(self, line):
+        """
+        Memoized (merge(line), merge_score(line)) on a tuple
+        """
+        result = self._merge_cache.get(line)
+        if result is None:
+            result = (merge(list(line)), merge_score(line))
+            self._merge_cache[line] = result
+        return result
+
+    def _slide(self, board, direction):
+        """
+        Slide one board in place and return True if any cell changed
+        """
+        base = board * self._board_size
+        cells = self.cells
+        changed = False
+        for line in self._lines[direction]:
+            indices = [base + offset for offset in line]
+            values = tuple([cells[idx] for idx in indices])
+            merged, points = self._merge(values)
+            if list(values) != merged:
+                changed = True
+                self.scores[board] += points
+                for offset, idx, value in zip(line, indices, merged):
+                    if cells[idx] != value:
+                        self._set_cell(board, offset, value)
+        return changed
+
+    def _has_move(self, board):
+        """
+        Return True if some direction changes board
+        """
+        base = board * self._board_size
+        cells = self.cells
+        if 0 in cells[base:base + self._board_size]:
+            return True
+        for direction in (LEFT, UP):
+            for line in self._lines[direction]:
+                values = tuple([cells[base + offset] for offset in line])
+                if list(values) != self._merge(values)[0]:
+                    return True
+        return False
+
+    def step(self, directions):
+        """
+        Apply directions[board] to every live board, spawning a tile on
+        the boards that changed.  A board whose direction leaves it
+        unchanged MAX_STALLS times in a row is retired.  Returns the
+        number of boards that moved.  Raises ValueError if a live board
+        is given anything but UP, DOWN, LEFT or RIGHT.
+        """
+        by_direction = {}
+        for board in range(self._num_boards):
+            if self.alive[board]:
+                if directions[board] not in OFFSETS:
+                    raise ValueError("invalid direction for board %d: %r" %
+                                     (board, directions[board]))
+                by_direction.setdefault(directions[board], []).append(board)
+        moved = 0
+        for direction in (UP, DOWN, LEFT, RIGHT):
+            for board in by_direction.get(direction, []):
+                self.attempts[board] += 1
+                if self._slide(board, direction):
+                    moved += 1
+                    self.moves[board] += 1
+                    self.stalls[board] = 0
+                    self.new_tile(board)
+                    if not self._has_move(board):
+                        self.alive[board] = False
+                else:
+                    self.stalls[board] += 1
+                    if self.stalls[board] >= MAX_STALLS:
+                        self.alive[board] = False
+        return moved
+
+    def run(self, policy=random_policy, max_moves=None):
+        """
+        Play every board until it has no move left, has been given
+        max_moves directions (moving or not) or is retired by step, with
+        policy(grid, rng) choosing directions.  Returns a dictionary of
+        throughput figures and the final score distribution.
+        """
+        start = time.time()
+        rounds = 0
+        while True in self.alive:
+            directions = [None] * self._num_boards
+            for board in range(self._num_boards):
+                if self.alive[board]:
+                    if max_moves is not None and self.attempts[board] >= max_moves:
+                        self.alive[board] = False
+                    else:
+                        directions[board] = policy(self.get_grid(board), self._rng)
+            self.step(directions)
+            rounds += 1
+        elapsed = max(time.time() - start, 1e-9)
+        total_moves = sum(self.moves)
+        scores = sorted(self.scores)
+        max_tiles = {}
+        for board in range(self._num_boards):
+            base = board * self._board_size
+            tile = max(self.cells[base:base + self._board_size])
+            max_tiles[tile] = max_tiles.get(tile, 0) + 1
+        return {"games": self._num_boards,
+                "moves": total_moves,
+                "rounds": rounds,
+                "seconds": elapsed,
+                "games_per_sec": self._num_boards / elapsed,
+                "moves_per_sec": total_moves / elapsed,
+                "min_score": scores[0],
+                "median_score": scores[len(scores) // 2],
+                "mean_score": float(sum(scores)) / len(scores),
+                "max_score": scores[-1],
+                "max_tiles": max_tiles}
+
+
+def check_batch_simulator():
+    """
+    Check that BatchSimulator.run terminates with fixed-direction
+    policies, with and without max_moves, and that a seeded board
+    follows the scalar game seeded the same way
+    """
+    for direction in (UP, DOWN, LEFT, RIGHT):
+        sim = BatchSimulator(8, 4, 4, seed=direction)
+        sim.run(policy=lambda grid, rng: direction, max_moves=1000)
+        assert max(sim.attempts) <= 1000
+        sim = BatchSimulator(8, 4, 4, seed=direction)
+        sim.run(policy=lambda grid, rng: direction)
+        assert True not in sim.alive
+    try:
+        BatchSimulator(2, 4, 4).run(policy=lambda grid, rng: None, max_moves=10)
+        assert False
+    except ValueError:
+        pass
+    for seed in range(5):
+        random.seed(seed)
+        game = TwentyFortyEight(4, 4)
+        game.new_tile()
+        game.new_tile()
+        sim = BatchSimulator(1, 4, 4, seed=seed)
+        directions = random.Random(seed + 100)
+        for dummy_move in range(40):
+            assert sim.get_grid(0) == game.grid
+            direction = directions.choice((UP, DOWN, LEFT, RIGHT))
+            game.move(direction)
+            sim.step([direction])
+            sim.alive[0] = True
+    print "batch simulator ok"
+
+
+# check_batch_simulator()
 poc_2048_gui.run_gui(TwentyFortyEight(4, 4))
@@ -5,6 +5,9 @@ Cookie Clicker Simulator
 import simpleplot
 import math
 import random
+import heapq
+import bisect
+import time
 # Used to increase the timeout, if necessary
 import codeskulptor
 codeskulptor.set_timeout(20)
@@ -14,18 +17,95 @@ import poc_clicker_provided as provided
 # Constants
 SIM_TIME = 10000000000.0
 
+class CompactHistory:
+    """
+    Columnar replacement for the ClickerState history list.  Times,
+    costs and totals are kept in array('d') columns and item names are
+    interned to small integer ids.  Optionally keeps only every stride-th
+    entry and/or only the last max_entries entries (ring buffer).
+    Indexing and iteration build the (time, item, cost, total) tuples on
+    demand.
+    """
+
+    def __init__(self, max_entries=None, stride=1):
+        from array import array
+        self._times = array('d')
+        self._items = array('i')
+        self._costs = array('d')
+        self._totals = array('d')
+        self._item_names = [None]
+        self._item_ids = {None: 0}
+        self._max_entries = max_entries
+        self._stride = stride
+        self._seen = 0
+        self._start = 0
+
+    def append(self, entry):
+        """
+        Record a (time, item, cost, total) tuple
+        """
+        self._seen += 1
+        if (self._seen - 1) % self._stride != 0:
+            return
+        cur_time, item, cost, total = entry
+        item_id = self._item_ids.get(item)
+        if item_id is None:
+            item_id = len(self._item_names)
+            self._item_ids[item] = item_id
+            self._item_names.append(item)
+        if self._max_entries is None or len(self._times) < self._max_entries:
+            self._times.append(cur_time)
+            self._items.append(item_id)
+            self._costs.append(cost)
+            self._totals.append(total)
+        else:
+            slot = self._start
+            self._times[slot] = cur_time
+            self._items[slot] = item_id
+            self._costs[slot] = cost
+            self._totals[slot] = total
+            self._start = (slot + 1) % self._max_entries
+
+    def num_recorded(self):
+        """
+        Return the number of entries appended, including dropped ones
+        """
+        return self._seen
+
+    def __len__(self):
+        return len(self._times)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[idx] for idx in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("history index out of range")
+        slot = (self._start + index) % len(self._times)
+        return (self._times[slot], self._item_names[self._items[slot]],
+                self._costs[slot], self._totals[slot])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
 class ClickerState:
     """
     Simple class to keep track of the game state.
     # Pylint warns you if you fail to use a leading underscore on class fields to indicate that they are private.
+    # history can be any empty container with append, e.g. CompactHistory().
     """
     
-    def __init__(self):
+    def __init__(self, history=None):
         self._totnum = 0.0
         self._curnum = 0.0
         self._curtime = 0.0
         self._cpsrate = 1.0
-        self._history = list()
+        if history == None:
+            history = list()
+        self._history = history
         self._history.append((0.0, None, 0.0, 0.0))
         
     def __str__(self):
@@ -51,6 +131,14 @@ class ClickerState:
         """
         return self._cpsrate
     
+    def get_total_cookies(self):
+        """
+        Return total number of cookies produced so far
+
+        Should return a float
+        """
+        return self._totnum
+    
     def get_time(self):
         """
         Get current time
@@ -107,14 +195,95 @@ class ClickerState:
             self._history.append((self._curtime, item_name, cost, self._totnum))
    
     
-def simulate_clicker(build_info, duration, strategy):
+class BuildIndex:
+    """
+    BuildInfo wrapper that keeps the items sorted by cost, so strategies
+    can find the cheapest or the most expensive affordable item with a
+    binary search instead of rebuilding cost lists.  It supports the
+    BuildInfo methods and is updated in place by update_item.
+    """
+
+    def __init__(self, build_info):
+        self._build_info = build_info
+        self._items = build_info.build_items()
+        self._order = dict()
+        self._keys = list()
+        for order, item in enumerate(self._items):
+            self._order[item] = order
+            self._keys.append((build_info.get_cost(item), order, item))
+        self._keys.sort()
+
+    def build_items(self):
+        """
+        Return the item names in BuildInfo order
+        """
+        return list(self._items)
+
+    def get_cost(self, item):
+        """
+        Return the current cost of item
+        """
+        return self._build_info.get_cost(item)
+
+    def get_cps(self, item):
+        """
+        Return the CPS added by item
+        """
+        return self._build_info.get_cps(item)
+
+    def update_item(self, item):
+        """
+        Update the cost of item after a purchase and re-sort it
+        """
+        old_key = (self._build_info.get_cost(item), self._order[item], item)
+        del self._keys[bisect.bisect_left(self._keys, old_key)]
+        self._build_info.update_item(item)
+        bisect.insort(self._keys, (self._build_info.get_cost(item), self._order[item], item))
+
+    def clone(self):
+        """
+        Return an independent copy
+        """
+        return BuildIndex(self._build_info.clone())
+
+    def cheapest(self):
+        """
+        Return (cost, item) for the cheapest item, ties going to the
+        first item in build_items order
+        """
+        cost, dummy_order, item = self._keys[0]
+        return (cost, item)
+
+    def most_expensive_affordable(self, budget):
+        """
+        Return (cost, item) for the most expensive item costing at most
+        budget, ties going to the first item in build_items order, or
+        None if nothing is affordable
+        """
+        pos = bisect.bisect_right(self._keys, (budget, float('inf'))) - 1
+        if pos < 0:
+            return None
+        cost = self._keys[pos][0]
+        dummy_cost, dummy_order, item = self._keys[bisect.bisect_left(self._keys, (cost,))]
+        return (cost, item)
+
+def build_index(build_info):
+    """
+    Return build_info as a BuildIndex, wrapping it if needed
+    """
+    if isinstance(build_info, BuildIndex):
+        return build_info
+    return BuildIndex(build_info)
+    
+def simulate_clicker(build_info, duration, strategy, history=None):
     """
     Function to run a Cookie Clicker game for the given
     duration with the given strategy.  Returns a ClickerState
-    object corresponding to game.
+    object corresponding to game.  history is passed on to ClickerState.
+    Strategies are given a BuildIndex over the game's BuildInfo.
     """
-    build_info_clone = build_info.clone()
-    new_state = ClickerState()
+    build_info_clone = build_index(build_info.clone())
+    new_state = ClickerState(history)
     stop = False
     # timeleft should in the while loop, it updates, because new_state.get_time() updates
     while duration>=new_state.get_time() and stop == False:
@@ -159,12 +328,7 @@ def strategy_cheap(cookies, cps, time_left, build_info):
     """
     cheap
     """
-    item_list = build_info.build_items()
-    cost_list = list()
-    for dummy_item in item_list:
-        cost_list.append(build_info.get_cost(dummy_item))
-    min_cost = min(cost_list)
-    item_use = item_list[cost_list.index(min_cost)]
+    min_cost, item_use = build_index(build_info).cheapest()
     if cps*time_left + cookies < min_cost:
         return None
     else:
@@ -174,20 +338,11 @@ def strategy_expensive(cookies, cps, time_left, build_info):
     """
     # different from cheap, not to find the max in list, but to find the max in those can be used
     """
-    item_list = build_info.build_items()
-    cost_list = list()
-    for dummy_item in item_list:
-        cost_list.append(build_info.get_cost(dummy_item))
-    max_cost = -float('inf')
-    for dummy_item2 in cost_list:
-        if cps*time_left + cookies >= dummy_item2:
-            if dummy_item2 > max_cost:
-                max_cost = dummy_item2
-                item_use = item_list[cost_list.index(max_cost)]
-    if max_cost == -float('inf'):
+    affordable = build_index(build_info).most_expensive_affordable(cps*time_left + cookies)
+    if affordable == None:
         return None
     else:
-        return item_use
+        return affordable[1]
                 
 
 def strategy_best(cookies, cps, time_left, build_info):
@@ -197,6 +352,222 @@ def strategy_best(cookies, cps, time_left, build_info):
     item_list = build_info.build_items()
     return random.choice(item_list)
         
+
+class PaybackPlanner:
+    """
+    Strategy that ranks items by payback time, the time to save up for
+    an item at the current CPS plus the time the item takes to earn its
+    cost back, and searches lookahead purchases deep over the beam best
+    ranked items to maximize the cookies produced by the end of the game.
+    Rankings are memoized on (cps, item costs), which identifies the item
+    counts.  Instances are drop-in strategy functions.
+    """
+
+    def __init__(self, lookahead=2, beam=3, cache_size=100000):
+        self._lookahead = lookahead
+        self._beam = beam
+        self._cache_size = cache_size
+        self._rank_cache = dict()
+        self._latencies = list()
+
+    def __call__(self, cookies, cps, time_left, build_info):
+        start = time.time()
+        items = build_info.build_items()
+        costs = tuple([build_info.get_cost(item) for item in items])
+        adds = [build_info.get_cps(item) for item in items]
+        # one clone to learn each item's cost growth
+        probe = build_info.clone()
+        growth = list()
+        for item in items:
+            probe.update_item(item)
+            growth.append(probe.get_cost(item) / build_info.get_cost(item))
+        self._adds = adds
+        self._growth = growth
+        dummy_value, choice = self._plan(cookies, cps, time_left, costs, 0.0, self._lookahead)
+        self._latencies.append(time.time() - start)
+        if choice == None:
+            return None
+        return items[choice]
+
+    def _rank(self, cps, costs):
+        """
+        Return item indices sorted by payback time
+        """
+        key = (cps, costs)
+        ranking = self._rank_cache.get(key)
+        if ranking == None:
+            if len(self._rank_cache) >= self._cache_size:
+                self._rank_cache.clear()
+            ranking = sorted(range(len(costs)),
+                             key=lambda idx: costs[idx] / cps + costs[idx] / self._adds[idx])
+            self._rank_cache[key] = ranking
+        return ranking
+
+    def _plan(self, cookies, cps, time_left, costs, produced, depth):
+        """
+        Return (cookies produced by the end, first item index) for the
+        best purchase sequence of at most depth items
+        """
+        best_value = produced + cps * time_left
+        best_choice = None
+        if depth == 0:
+            return best_value, best_choice
+        tried = 0
+        for idx in self._rank(cps, costs):
+            if tried == self._beam:
+                break
+            cost = costs[idx]
+            # same rounding as ClickerState.time_until
+            wait = max(0.0, float(math.ceil((cost - cookies) / cps)))
+            if wait > time_left:
+                continue
+            tried += 1
+            next_costs = costs[:idx] + (cost * self._growth[idx],) + costs[idx + 1:]
+            value, dummy_choice = self._plan(cookies + cps * wait - cost, cps + self._adds[idx],
+                                             time_left - wait, next_costs,
+                                             produced + cps * wait, depth - 1)
+            if best_choice == None or value > best_value:
+                best_value = value
+                best_choice = idx
+        return best_value, best_choice
+
+    def latencies(self):
+        """
+        Return the time in seconds taken by each decision so far
+        """
+        return list(self._latencies)
+
+    def mean_latency(self):
+        """
+        Return the average time in seconds per decision
+        """
+        if self._latencies == []:
+            return 0.0
+        return sum(self._latencies) / len(self._latencies)
+        
+
+def simulate_clicker_events(build_info, duration, strategy, history=None):
+    """
+    Event-driven version of simulate_clicker for strategy_none,
+    strategy_cursor and strategy_cheap.  strategy_cheap is replaced by a
+    priority queue of items keyed on cost (at a fixed CPS the cheapest
+    item is also the next one affordable), so each purchase is one heap
+    operation instead of a strategy call.  Produces the same ClickerState
+    history as simulate_clicker; any other strategy, strategy_expensive
+    included, falls back to simulate_clicker, whose BuildIndex already
+    serves it.
+    """
+    if strategy is strategy_none:
+        new_state = ClickerState(history)
+        new_state.wait(duration - new_state.get_time())
+        return new_state
+    if strategy is not strategy_cheap and strategy is not strategy_cursor:
+        return simulate_clicker(build_info, duration, strategy, history)
+    build_info_clone = build_info.clone()
+    new_state = ClickerState(history)
+    if strategy is strategy_cursor:
+        heap = [(build_info_clone.get_cost("Cursor"), 0, "Cursor")]
+    else:
+        # ties on cost go to the first item in build_items(), like cost_list.index
+        heap = [(build_info_clone.get_cost(item), order, item)
+                for order, item in enumerate(build_info_clone.build_items())]
+        heapq.heapify(heap)
+    while duration >= new_state.get_time():
+        timeleft = duration - new_state.get_time()
+        cost, order, item = heap[0]
+        if strategy is strategy_cheap and new_state.get_cps()*timeleft + new_state.get_cookies() < cost:
+            new_state.wait(timeleft)
+            break
+        elapse = new_state.time_until(cost)
+        if timeleft < elapse:
+            new_state.wait(timeleft)
+            break
+        new_state.wait(elapse)
+        new_state.buy_item(item, cost, build_info_clone.get_cps(item))
+        build_info_clone.update_item(item)
+        heapq.heapreplace(heap, (build_info_clone.get_cost(item), order, item))
+    return new_state
+        
+# Columns of a tournament results table
+TOURNAMENT_FIELDS = ["strategy", "build", "duration", "seed", "total_cookies",
+                     "cookies", "cps", "purchases", "seconds"]
+
+def make_build_info(growth_factor=None, items=None):
+    """
+    Return a BuildInfo based on the default one, optionally with another
+    cost growth factor and/or restricted to the given item names
+    """
+    base = provided.BuildInfo()
+    if growth_factor == None:
+        growth_factor = provided.BUILD_GROWTH
+    info = dict()
+    for item in base.build_items():
+        if items == None or item in items:
+            info[item] = [base.get_cost(item), base.get_cps(item)]
+    return provided.BuildInfo(info, growth_factor)
+
+def tournament_task(task):
+    """
+    Run one tournament game and return its row of results.
+    task is (strategy_name, strategy, build_name, build_info, duration, seed)
+    """
+    strategy_name, strategy, build_name, build_info, duration, seed = task
+    if seed != None:
+        random.seed(seed)
+    start = time.time()
+    history = CompactHistory(max_entries=1)
+    state = simulate_clicker_events(build_info, duration, strategy, history)
+    return {"strategy": strategy_name,
+            "build": build_name,
+            "duration": duration,
+            "seed": seed,
+            "total_cookies": state.get_total_cookies(),
+            "cookies": state.get_cookies(),
+            "cps": state.get_cps(),
+            "purchases": history.num_recorded() - 1,
+            "seconds": time.time() - start}
+
+def run_tournament(strategies, durations, build_infos=None, seeds=(None,), pool=None):
+    """
+    Play every combination of strategy, duration, BuildInfo variant
+    and seed, headless.  strategies and build_infos map names to
+    strategy functions and BuildInfo objects.  pool is anything with a
+    map method, e.g. multiprocessing.Pool(); games run serially without
+    one.  Returns the list of result rows.
+    """
+    if build_infos == None:
+        build_infos = {"default": provided.BuildInfo()}
+    tasks = []
+    for strategy_name in sorted(strategies):
+        for build_name in sorted(build_infos):
+            for duration in durations:
+                for seed in seeds:
+                    tasks.append((strategy_name, strategies[strategy_name], build_name,
+                                  build_infos[build_name], duration, seed))
+    if pool == None:
+        return [tournament_task(task) for task in tasks]
+    return list(pool.map(tournament_task, tasks))
+
+def write_results_csv(rows, filename):
+    """
+    Write tournament rows to a CSV file
+    """
+    import csv
+    out_file = open(filename, "w")
+    writer = csv.DictWriter(out_file, TOURNAMENT_FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+    out_file.close()
+
+def write_results_json(rows, filename):
+    """
+    Write tournament rows to a JSON file
+    """
+    import json
+    out_file = open(filename, "w")
+    json.dump(rows, out_file, indent=1)
+    out_file.close()
+        
 def run_strategy(strategy_name, time, strategy):
     """
     Run a simulation with one strategy
@@ -223,5 +594,6 @@ def run():
     run_strategy("Cheap", SIM_TIME, strategy_cheap)
     run_strategy("Expensive", SIM_TIME, strategy_expensive)
     run_strategy("Best", SIM_TIME, strategy_best)
+    run_strategy("Planner", SIM_TIME, PaybackPlanner())
     
 run()
@@ -8,27 +8,148 @@ import codeskulptor
 codeskulptor.set_timeout(20)
 
 
-def resources_vs_time(upgrade_cost_increment, num_upgrade):
+def iter_resources_vs_time(upgrade_cost_increment, num_upgrade, every=1, points_per_decade=None):
     """
-    Build function that performs unit upgrades with specified cost increments
+    Generator version of resources_vs_time that yields the points one
+    at a time.  Only every k-th upgrade is yielded, or about
+    points_per_decade log-spaced upgrades per factor of ten if given;
+    the last point is always yielded.
     """
     rate = 1
     current_time = 0
     current_cost = 1
     total_resources_generated = 0
-    data = []
+    next_mark = 1
+    if points_per_decade != None:
+        step = 10.0 ** (1.0 / points_per_decade)
 
     while num_upgrade > 0:
         time_need = current_cost / rate
         current_time += time_need
         total_resources_generated += current_cost
 
-        data.append([current_time, total_resources_generated])
+        if num_upgrade == 1:
+            yield [current_time, total_resources_generated]
+        elif points_per_decade != None:
+            if rate >= next_mark:
+                yield [current_time, total_resources_generated]
+                next_mark = max(rate + 1, int(math.ceil(next_mark * step)))
+        elif rate % every == 0:
+            yield [current_time, total_resources_generated]
         rate += 1
         current_cost = current_cost + upgrade_cost_increment
         num_upgrade -= 1
-    
-    return data
+
+def resources_vs_time(upgrade_cost_increment, num_upgrade):
+    """
+    Build function that performs unit upgrades with specified cost increments
+    """
+    return list(iter_resources_vs_time(upgrade_cost_increment, num_upgrade))
+
+def write_resources_csv(points, filename):
+    """
+    Stream [time, total] points to a CSV file without keeping them
+    """
+    out_file = open(filename, "w")
+    out_file.write("time,total\n")
+    for point in points:
+        out_file.write(repr(float(point[0])) + "," + repr(float(point[1])) + "\n")
+    out_file.close()
+
+def write_resources_binary(points, filename, chunk=4096):
+    """
+    Stream [time, total] points to a file of native-endian float64
+    pairs, buffering at most chunk points at a time
+    """
+    from array import array
+    out_file = open(filename, "wb")
+    buf = array('d')
+    for point in points:
+        buf.append(point[0])
+        buf.append(point[1])
+        if len(buf) >= 2 * chunk:
+            buf.tofile(out_file)
+            buf = array('d')
+    buf.tofile(out_file)
+    out_file.close()
+
+# Upgrade k costs 1 + (k - 1) * increment and is bought at rate k, so
+#   time after n upgrades  = (1 - increment) * H(n) + increment * n
+#   total after n upgrades = n + increment * n * (n - 1) / 2
+# where H(n) is the n-th harmonic number.  These hold for true division:
+# with an int increment resources_vs_time floors current_cost / rate, so
+# the closed forms below treat the increment as a float and match
+# resources_vs_time(float(increment), n) instead.
+EULER_GAMMA = 0.5772156649015329
+HARMONIC_EXACT_LIMIT = 1000
+
+def harmonic_prefix(num):
+    """
+    Return [H(0), H(1), ..., H(num)] as cumulative sums
+    """
+    prefix = [0.0]
+    total = 0.0
+    for rate in range(1, num + 1):
+        total += 1.0 / rate
+        prefix.append(total)
+    return prefix
+
+HARMONIC_TABLE = harmonic_prefix(HARMONIC_EXACT_LIMIT)
+
+def harmonic(num):
+    """
+    Return H(num), summed exactly for small num and from the asymptotic
+    expansion (accurate to double precision) for large num
+    """
+    if num <= HARMONIC_EXACT_LIMIT:
+        return HARMONIC_TABLE[num]
+    inverse = 1.0 / num
+    inverse2 = inverse * inverse
+    return (math.log(num) + EULER_GAMMA + inverse / 2 - inverse2 / 12 +
+            inverse2 * inverse2 / 120)
+
+def final_resources(upgrade_cost_increment, num_upgrade):
+    """
+    Closed form for the last point of
+    resources_vs_time(float(upgrade_cost_increment), num_upgrade)
+    """
+    upgrade_cost_increment = float(upgrade_cost_increment)
+    final_time = ((1 - upgrade_cost_increment) * harmonic(num_upgrade) +
+                  upgrade_cost_increment * num_upgrade)
+    final_total = num_upgrade + upgrade_cost_increment * num_upgrade * (num_upgrade - 1) / 2.0
+    return [final_time, final_total]
+
+def sweep_final_resources(params):
+    """
+    Return one row [increment, num_upgrade, time, total] per
+    (upgrade_cost_increment, num_upgrade) pair in params, with the
+    increment taken as a float (see final_resources)
+    """
+    return [[increment, num] + final_resources(increment, num) for increment, num in params]
+
+def resources_vs_time_batch(params):
+    """
+    Compute the trajectories of several (upgrade_cost_increment,
+    num_upgrade) pairs at once from one shared table of harmonic
+    numbers.  Returns (times, totals), two tables with one row per
+    parameter pair and one column per upgrade.  Increments are taken
+    as floats (see final_resources).
+    """
+    max_upgrade = max([num for dummy_increment, num in params] + [0])
+    if max_upgrade <= HARMONIC_EXACT_LIMIT:
+        prefix = HARMONIC_TABLE
+    else:
+        prefix = harmonic_prefix(max_upgrade)
+    times = []
+    totals = []
+    for increment, num in params:
+        increment = float(increment)
+        times.append([(1 - increment) * prefix[idx] + increment * idx
+                      for idx in range(1, num + 1)])
+        totals.append([idx + increment * idx * (idx - 1) / 2.0
+                       for idx in range(1, num + 1)])
+    return times, totals
+
 
 def test():
     """
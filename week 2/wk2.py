@@ -3,6 +3,9 @@ Monte Carlo Tic-Tac-Toe Player
 """
 
 import random
+import copy
+import time
+import math
 import poc_ttt_gui
 import poc_ttt_provided as provided
 
@@ -13,41 +16,280 @@ NTRIALS = 10    # Number of trials to run
 MCMATCH = 2.0  # Score for squares played by the machine player
 MCOTHER = 2.0  # Score for squares played by the other player
     
+# Winning-line masks per board size, square (row, col) is bit row * dim + col
+LINE_MASKS = {}
+
+def winning_lines(dim):
+    """
+    Return (line_masks, cell_lines) for a dim x dim board, where
+    cell_lines[idx] lists the masks of the lines through square idx
+    """
+    if dim not in LINE_MASKS:
+        lines = []
+        for row in range(dim):
+            lines.append([row * dim + col for col in range(dim)])
+        for col in range(dim):
+            lines.append([row * dim + col for row in range(dim)])
+        lines.append([idx * dim + idx for idx in range(dim)])
+        lines.append([idx * dim + dim - 1 - idx for idx in range(dim)])
+        line_masks = []
+        cell_lines = [[] for dummy_idx in range(dim * dim)]
+        for line in lines:
+            mask = 0
+            for idx in line:
+                mask |= 1 << idx
+            line_masks.append(mask)
+            for idx in line:
+                cell_lines[idx].append(mask)
+        LINE_MASKS[dim] = (line_masks, cell_lines)
+    return LINE_MASKS[dim]
+
+class FastTTTBoard:
+    """
+    TTTBoard with the same interface, storing each player's squares in a
+    bitmask.  The winner is found when a move is made by checking only
+    the lines through that square, and the empty squares are kept in an
+    incrementally updated list.
+    """
+
+    def __init__(self, dim, reverse = False, board = None):
+        self._dim = dim
+        self._reverse = reverse
+        self._cell_lines = winning_lines(dim)[1]
+        self._masks = {provided.PLAYERX: 0, provided.PLAYERO: 0}
+        self._winner = None
+        self._empty = [(row, col) for row in range(dim) for col in range(dim)]
+        self._empty_index = dict([(cell, idx) for idx, cell in enumerate(self._empty)])
+        if board != None:
+            for row in range(dim):
+                for col in range(dim):
+                    if board[row][col] != provided.EMPTY:
+                        self.move(row, col, board[row][col])
+
+    def __str__(self):
+        rows = []
+        for row in range(self._dim):
+            rows.append(" | ".join([provided.STRMAP[self.square(row, col)]
+                                    for col in range(self._dim)]))
+        return "\n".join(rows)
+
+    def get_dim(self):
+        """
+        Return the dimension of the board.
+        """
+        return self._dim
+
+    def square(self, row, col):
+        """
+        Return the status (EMPTY, PLAYERX, PLAYERO) of the square.
+        """
+        bit = 1 << (row * self._dim + col)
+        if self._masks[provided.PLAYERX] & bit:
+            return provided.PLAYERX
+        if self._masks[provided.PLAYERO] & bit:
+            return provided.PLAYERO
+        return provided.EMPTY
+
+    def get_empty_squares(self):
+        """
+        Return a list of (row, col) tuples for all empty squares
+        """
+        return list(self._empty)
+
+    def num_empty(self):
+        """
+        Return the number of empty squares
+        """
+        return len(self._empty)
+
+    def move(self, row, col, player):
+        """
+        Place player on the board at position (row, col).
+        Does nothing if the square is not empty.
+        """
+        idx = self._empty_index.pop((row, col), None)
+        if idx == None:
+            return
+        last = self._empty.pop()
+        if last != (row, col):
+            self._empty[idx] = last
+            self._empty_index[last] = idx
+        cell = row * self._dim + col
+        mask = self._masks[player] | (1 << cell)
+        self._masks[player] = mask
+        if self._winner == None:
+            for line in self._cell_lines[cell]:
+                if mask & line == line:
+                    self._winner = player
+                    break
+
+    def play_out(self, player, rng = random):
+        """
+        Finish the game with random moves, player moving first.  Playing
+        the empty squares in shuffled order gives the same distribution
+        as picking a random empty square every turn.
+        """
+        if self._winner != None:
+            return
+        order = list(self._empty)
+        rng.shuffle(order)
+        other = provided.switch_player(player)
+        masks = self._masks
+        cell_lines = self._cell_lines
+        dim = self._dim
+        played = 0
+        for row, col in order:
+            cell = row * dim + col
+            mask = masks[player] | (1 << cell)
+            masks[player] = mask
+            played += 1
+            for line in cell_lines[cell]:
+                if mask & line == line:
+                    self._winner = player
+                    break
+            if self._winner != None:
+                break
+            player, other = other, player
+        # squares left in order are still empty
+        self._empty = order[played:]
+        self._empty_index = dict([(cell, idx) for idx, cell in enumerate(self._empty)])
+
+    def get_mask(self, player):
+        """
+        Return the bitmask of the squares taken by player
+        """
+        return self._masks[player]
+
+    def check_win(self):
+        """
+        Returns a constant associated with the state of the game:
+        PLAYERX, PLAYERO, DRAW or None if the game is in progress.
+        """
+        if self._winner != None:
+            if self._reverse:
+                return provided.switch_player(self._winner)
+            return self._winner
+        if self._empty == []:
+            return provided.DRAW
+        return None
+
+    def clone(self):
+        """
+        Return a copy of the board.
+        """
+        new_board = copy.copy(self)
+        new_board._masks = dict(self._masks)
+        new_board._empty = list(self._empty)
+        new_board._empty_index = dict(self._empty_index)
+        return new_board
+
+def to_fast_board(board):
+    """
+    Return a FastTTTBoard copy of any TTTBoard
+    """
+    if isinstance(board, FastTTTBoard):
+        return board.clone()
+    dim = board.get_dim()
+    # TTTBoard has no accessor for reverse
+    reverse = getattr(board, "_reverse", False)
+    return FastTTTBoard(dim, reverse, [[board.square(row, col) for col in range(dim)]
+                                       for row in range(dim)])
+    
 # Add your functions here.
-def mc_trial(board, player):
+def mc_trial(board, player, rng = random):
     """
     This function takes a current board and the next player to move.
     """
+    if isinstance(board, FastTTTBoard):
+        board.play_out(player, rng)
+        return
     while board.check_win() == None:
         empty_list = board.get_empty_squares()
-        pick_position = random.choice(empty_list)
+        pick_position = rng.choice(empty_list)
         board.move(pick_position[0], pick_position[1], player)
         player = provided.switch_player(player)
         
 def mc_update_scores(scores, board, player):
     """
     score the completed board and update the scores grid
+    (left unchanged for a draw or an unfinished game)
+    """
+    winner = board.check_win()
+    if winner == provided.DRAW or winner == None:
+        return
+    if winner == player:
+        match_score, other_score = MCMATCH, -MCOTHER
+    else:
+        match_score, other_score = -MCMATCH, MCOTHER
+    for row in range(board.get_dim()):
+        score_row = scores[row]
+        for col in range(board.get_dim()):
+            status = board.square(row, col)
+            if status == player:
+                score_row[col] += match_score
+            elif status != provided.EMPTY:
+                score_row[col] += other_score
+
+def mc_update_scores_flat(flat_scores, boards, player):
+    """
+    Batched mc_update_scores: add the scores of every completed board in
+    boards to flat_scores, a list of dim * dim scores in row-major order
     """
-    if board.check_win() == provided.DRAW:
-        scores = [ [0 for dummy_col in range(board.get_dim())] for dummy_row in range(board.get_dim())]
-    elif board.check_win() == player:
-        for row in range(board.get_dim()):
-            for col in range(board.get_dim()):
-                if board.square(row, col) == provided.EMPTY:
-                    scores[row][col] += 0
-                elif board.square(row, col) == player:
-                    scores[row][col] += MCMATCH                
-                elif board.square(row, col) != player:
-                    scores[row][col] += -MCOTHER                   
-    elif board.check_win() != player:
-        for row in range(board.get_dim()):
-            for col in range(board.get_dim()):
-                if board.square(row, col) == provided.EMPTY:
-                    scores[row][col] += 0
-                elif board.square(row, col) == player:
-                    scores[row][col] += -MCMATCH
-                elif board.square(row, col) != player:
-                    scores[row][col] += MCOTHER
+    for board in boards:
+        winner = board.check_win()
+        if winner == provided.DRAW or winner == None:
+            continue
+        if winner == player:
+            match_score, other_score = MCMATCH, -MCOTHER
+        else:
+            match_score, other_score = -MCMATCH, MCOTHER
+        if isinstance(board, FastTTTBoard):
+            for mask, delta in ((board.get_mask(player), match_score),
+                                (board.get_mask(provided.switch_player(player)), other_score)):
+                while mask:
+                    low_bit = mask & -mask
+                    flat_scores[low_bit.bit_length() - 1] += delta
+                    mask ^= low_bit
+        else:
+            dim = board.get_dim()
+            for row in range(dim):
+                for col in range(dim):
+                    status = board.square(row, col)
+                    if status == player:
+                        flat_scores[row * dim + col] += match_score
+                    elif status != provided.EMPTY:
+                        flat_scores[row * dim + col] += other_score
+
+def test_score_kernel(trials = 200):
+    """
+    Check mc_update_scores and mc_update_scores_flat against the scoring
+    rules on random finished boards
+    """
+    for dim in (3, 4):
+        for dummy_num in range(trials):
+            board = provided.TTTBoard(dim)
+            mc_trial(board, provided.PLAYERX)
+            fast_board = to_fast_board(board)
+            for player in (provided.PLAYERX, provided.PLAYERO):
+                winner = board.check_win()
+                expected = [ [0 for dummy_col in range(dim)] for dummy_row in range(dim)]
+                for row in range(dim):
+                    for col in range(dim):
+                        status = board.square(row, col)
+                        if winner == provided.DRAW or status == provided.EMPTY:
+                            continue
+                        if winner == player:
+                            expected[row][col] = MCMATCH if status == player else -MCOTHER
+                        else:
+                            expected[row][col] = -MCMATCH if status == player else MCOTHER
+                for test_board in (board, fast_board):
+                    scores = [ [0 for dummy_col in range(dim)] for dummy_row in range(dim)]
+                    mc_update_scores(scores, test_board, player)
+                    assert scores == expected
+                flat_scores = [0] * (dim * dim)
+                mc_update_scores_flat(flat_scores, [board, fast_board], player)
+                assert flat_scores == [2 * value for row in expected for value in row]
+    print "score kernel ok"
           
 def get_best_move(board, scores):
     """
@@ -72,12 +314,253 @@ def mc_move(board, player, trials):
     return a move for the machine player 
     """
     scores = [ [0 for dummy_col in range(board.get_dim())] for dummy_row in range(board.get_dim())]
+    fast_board = to_fast_board(board)
     for dummy_num in range(trials):
-        class_copy = provided.TTTBoard(board.get_dim(), reverse = False, board = None)
-        board_trial = class_copy.clone()
+        board_trial = fast_board.clone()
         mc_trial(board_trial, player)
         mc_update_scores(scores, board_trial, player)
     return get_best_move(board, scores)
+
+def mc_worker(task):
+    """
+    Run Monte Carlo trials on its own scores grid and random stream.
+    task is (board, player, trials, seed, deadline): trials are run
+    in batches until the deadline (a time.time() value) if it is not
+    None.  Returns (scores, number of trials run).
+    """
+    board, player, trials, seed, deadline = task
+    rng = random.Random(seed)
+    dim = board.get_dim()
+    flat_scores = [0] * (dim * dim)
+    count = 0
+    while True:
+        finished = []
+        for dummy_num in range(trials):
+            board_trial = board.clone()
+            mc_trial(board_trial, player, rng)
+            finished.append(board_trial)
+        mc_update_scores_flat(flat_scores, finished, player)
+        count += trials
+        if deadline == None or time.time() >= deadline:
+            return [flat_scores[row * dim:(row + 1) * dim] for row in range(dim)], count
+
+def merge_score_grids(grids):
+    """
+    Add up a list of scores grids
+    """
+    merged = [list(row) for row in grids[0]]
+    for grid in grids[1:]:
+        for row in range(len(merged)):
+            for col in range(len(merged[row])):
+                merged[row][col] += grid[row][col]
+    return merged
+
+def mc_run_workers(board, player, trials, pool, workers, seed, deadline):
+    """
+    Split the trials between workers, run them through pool.map (or
+    serially without a pool) and return the merged scores grid
+    """
+    fast_board = to_fast_board(board)
+    seeder = random.Random(seed)
+    tasks = []
+    for worker in range(workers):
+        share = trials // workers + (1 if worker < trials % workers else 0)
+        if share > 0:
+            tasks.append((fast_board, player, share, seeder.getrandbits(32), deadline))
+    if pool == None:
+        results = [mc_worker(task) for task in tasks]
+    else:
+        results = list(pool.map(mc_worker, tasks))
+    return merge_score_grids([scores for scores, dummy_count in results])
+
+def mc_move_parallel(board, player, trials, pool = None, workers = 4, seed = None):
+    """
+    mc_move with the trials split across workers, each with its own
+    scores grid and random seed.  pool is anything with a map method,
+    e.g. multiprocessing.Pool(workers).
+    """
+    scores = mc_run_workers(board, player, trials, pool, workers, seed, None)
+    return get_best_move(board, scores)
+
+def mc_move_deadline(board, player, millis, pool = None, workers = 1, batch = 16, seed = None):
+    """
+    Return a move after running as many trials as fit in millis
+    milliseconds, in batches of batch trials per worker.  Has the same
+    signature as mc_move, with millis in place of trials.
+    """
+    deadline = time.time() + millis / 1000.0
+    scores = mc_run_workers(board, player, batch * workers, pool, workers, seed, deadline)
+    return get_best_move(board, scores)
+
+class MCTSPlayer:
+    """
+    Monte Carlo tree search (UCT) move selector.  Statistics are kept
+    per board position, so the tree built for one move is reused for the
+    next.  Whenever a search pass grows the table past max_nodes the
+    least recently used positions are evicted.  An instance is called like mc_move; if
+    millis is given, each call searches for that many milliseconds
+    instead of running a fixed number of trials.
+    """
+
+    def __init__(self, exploration = 1.4, max_nodes = 200000, millis = None):
+        self._exploration = exploration
+        self._max_nodes = max_nodes
+        self._millis = millis
+        # position -> [visits, reward for the player who moved into it, last use]
+        self._nodes = {}
+        self._game = None
+        self._clock = 0
+
+    def __call__(self, board, player, trials):
+        return self.get_move(board, player, trials)
+
+    def num_nodes(self):
+        """
+        Return the number of positions in the table
+        """
+        return len(self._nodes)
+
+    def get_move(self, board, player, trials):
+        """
+        Return the most visited move after the search
+        """
+        root = to_fast_board(board)
+        game = (root.get_dim(), getattr(board, "_reverse", False))
+        if game != self._game:
+            self._nodes = {}
+            self._game = game
+        root_key = (root.get_mask(provided.PLAYERX), root.get_mask(provided.PLAYERO))
+        if self._millis == None:
+            for dummy_num in range(trials):
+                self._search(root.clone(), root_key, player)
+                if len(self._nodes) > self._max_nodes:
+                    self._evict()
+        else:
+            deadline = time.time() + self._millis / 1000.0
+            while True:
+                self._search(root.clone(), root_key, player)
+                if len(self._nodes) > self._max_nodes:
+                    self._evict()
+                if time.time() >= deadline:
+                    break
+        best_move = None
+        best_visits = -1
+        for move in root.get_empty_squares():
+            node = self._nodes.get(self._child_key(root_key, move, player, root.get_dim()))
+            if node != None and node[0] > best_visits:
+                best_visits = node[0]
+                best_move = move
+        return best_move
+
+    def _touch(self, key):
+        """
+        Return the node for key, creating it if needed, and mark it used
+        """
+        self._clock += 1
+        node = self._nodes.get(key)
+        if node == None:
+            node = [0, 0.0, self._clock]
+            self._nodes[key] = node
+        else:
+            node[2] = self._clock
+        return node
+
+    def _child_key(self, key, move, player, dim):
+        """
+        Return the position reached by player taking move
+        """
+        bit = 1 << (move[0] * dim + move[1])
+        if player == provided.PLAYERX:
+            return (key[0] | bit, key[1])
+        return (key[0], key[1] | bit)
+
+    def _search(self, board, key, player):
+        """
+        Run one selection/expansion/playout/backup pass from board
+        """
+        dim = board.get_dim()
+        # touching the root keeps it out of every eviction
+        path = [(self._touch(key), None)]
+        while board.check_win() == None:
+            parent_visits = path[-1][0][0]
+            log_visits = math.log(parent_visits + 1)
+            best_move = None
+            best_value = -1.0
+            unvisited = []
+            for move in board.get_empty_squares():
+                node = self._nodes.get(self._child_key(key, move, player, dim))
+                if node == None or node[0] == 0:
+                    unvisited.append(move)
+                elif not unvisited:
+                    value = (node[1] / node[0] +
+                             self._exploration * math.sqrt(log_visits / node[0]))
+                    if value > best_value:
+                        best_value = value
+                        best_move = move
+            if unvisited:
+                best_move = random.choice(unvisited)
+            key = self._child_key(key, best_move, player, dim)
+            board.move(best_move[0], best_move[1], player)
+            path.append((self._touch(key), player))
+            player = provided.switch_player(player)
+            if unvisited:
+                board.play_out(player)
+                break
+        winner = board.check_win()
+        for node, mover in path:
+            node[0] += 1
+            if winner == mover:
+                node[1] += 1.0
+            elif winner == provided.DRAW:
+                node[1] += 0.5
+
+    def _evict(self):
+        """
+        Drop the least recently used positions down to 3/4 of max_nodes
+        """
+        by_use = sorted(self._nodes.items(), key = lambda item: item[1][2])
+        for key, dummy_node in by_use[:len(by_use) - self._max_nodes * 3 // 4]:
+            del self._nodes[key]
+
+def play_quiet_game(dim, move_x, move_o, ntrials, reverse = False):
+    """
+    Play one game without printing and return the result of check_win
+    """
+    board = FastTTTBoard(dim, reverse)
+    player = provided.PLAYERX
+    while board.check_win() == None:
+        if player == provided.PLAYERX:
+            row, col = move_x(board, player, ntrials)
+        else:
+            row, col = move_o(board, player, ntrials)
+        board.move(row, col, player)
+        player = provided.switch_player(player)
+    return board.check_win()
+
+def benchmark_mcts(dim = 3, games = 10, budgets = (10, 50, 200)):
+    """
+    For each per-move time budget in milliseconds, play MCTSPlayer
+    against mc_move_deadline with the same budget, alternating who
+    starts, and print MCTS wins/draws/losses
+    """
+    for millis in budgets:
+        results = {"win": 0, "draw": 0, "loss": 0}
+        for game in range(games):
+            mcts = MCTSPlayer(millis = millis)
+            if game % 2 == 0:
+                winner = play_quiet_game(dim, mcts, mc_move_deadline, millis)
+                mcts_player = provided.PLAYERX
+            else:
+                winner = play_quiet_game(dim, mc_move_deadline, mcts, millis)
+                mcts_player = provided.PLAYERO
+            if winner == provided.DRAW:
+                results["draw"] += 1
+            elif winner == mcts_player:
+                results["win"] += 1
+            else:
+                results["loss"] += 1
+        print dim, "x", dim, millis, "ms per move: MCTS", results
+
        
 
 # Test game with the console or the GUI.
@@ -85,5 +568,7 @@ def mc_move(board, player, trials):
 # Both should be commented out when you submit for
 # testing to save time.
 
+# test_score_kernel()
+# benchmark_mcts(5, 4)
 # provided.play_game(mc_move, NTRIALS, False)        
 # poc_ttt_gui.run_gui(3, provided.PLAYERX, mc_move, NTRIALS, False)
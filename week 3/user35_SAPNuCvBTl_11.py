@@ -3,6 +3,9 @@ Planner for Yahtzee
 Simplifications:  only allow discard and roll, only score against upper level
 """
 
+import math
+import time
+
 # Used to increase the timeout, if necessary
 import codeskulptor
 codeskulptor.set_timeout(20)
@@ -64,6 +67,62 @@ def expected_value(held_dice, num_die_sides, num_free_dice):
     return expectvalue
 
 
+# Multiset engine: rolls are enumerated as sorted outcomes weighted by
+# how many ordered sequences produce them.
+OUTCOME_CACHE = {}
+SCORE_CACHE = {}
+
+def gen_sorted_outcomes(num_die_sides, num_free_dice):
+    """
+    Return a list of (sorted outcome, number of orderings) pairs for
+    rolling num_free_dice dice with num_die_sides sides.
+    """
+    key = (num_die_sides, num_free_dice)
+    if key not in OUTCOME_CACHE:
+        outcomes = []
+        partial = []
+        def extend(smallest, left):
+            """
+            Append every non-decreasing completion of partial
+            """
+            if left == 0:
+                weight = math.factorial(num_free_dice)
+                for value in set(partial):
+                    weight //= math.factorial(partial.count(value))
+                outcomes.append((tuple(partial), weight))
+                return
+            for value in range(smallest, num_die_sides + 1):
+                partial.append(value)
+                extend(value, left - 1)
+                partial.pop()
+        extend(1, num_free_dice)
+        OUTCOME_CACHE[key] = outcomes
+    return OUTCOME_CACHE[key]
+
+
+def cached_score(hand):
+    """
+    score() memoized on the sorted hand
+    """
+    key = tuple(sorted(hand))
+    if key not in SCORE_CACHE:
+        SCORE_CACHE[key] = score(key)
+    return SCORE_CACHE[key]
+
+
+def expected_value_multiset(held_dice, num_die_sides, num_free_dice):
+    """
+    Same result as expected_value, enumerating the C(n+s-1, n) sorted
+    outcomes instead of the s**n sequences (252 instead of 7776 for
+    five six-sided dice).  Scores are summed as exact integers and
+    divided once, so the result is the correctly rounded expectation.
+    """
+    total = 0
+    for outcome, weight in gen_sorted_outcomes(num_die_sides, num_free_dice):
+        total += weight * cached_score(held_dice + outcome)
+    return float(total) / num_die_sides ** num_free_dice
+
+
 def gen_all_holds(hand):
     """
     Generate all possible choices of dice from hand to hold.
@@ -83,6 +142,42 @@ def gen_all_holds(hand):
     return dice_hold
 
 
+def gen_all_holds_fast(hand):
+    """
+    Generate all possible choices of dice from hand to hold, as sorted
+    tuples.  Instead of walking all 2**n subsets and removing duplicates,
+    it picks 0..k copies of each value that appears k times, so every
+    distinct hold is built exactly once.  For a sorted hand this is the
+    same set as gen_all_holds.
+    """
+    counts = []
+    for value in sorted(hand):
+        if counts != [] and counts[-1][0] == value:
+            counts[-1][1] += 1
+        else:
+            counts.append([value, 1])
+    holds = [()]
+    for value, count in counts:
+        holds = [hold + (value,) * num for hold in holds for num in range(count + 1)]
+    return set(holds)
+
+
+def benchmark_holds(max_dice = 12, num_die_sides = 6):
+    """
+    Time gen_all_holds against gen_all_holds_fast on sorted hands
+    """
+    for num_dice in range(5, max_dice + 1):
+        hand = tuple(sorted([1 + idx % num_die_sides for idx in range(num_dice)]))
+        start = time.time()
+        slow_holds = gen_all_holds(hand)
+        slow = time.time() - start
+        start = time.time()
+        fast_holds = gen_all_holds_fast(hand)
+        fast = time.time() - start
+        assert slow_holds == fast_holds
+        print num_dice, "dice:", len(fast_holds), "holds,", slow, "s vs", fast, "s"
+
+
 def strategy(hand, num_die_sides):
     """
     Compute the hold that maximizes the expected value when the
@@ -104,6 +199,261 @@ def strategy(hand, num_die_sides):
             tohold = choice
     return (best_expect, tohold)
 
+# Precomputed strategy tables.
+# File layout (native byte order): header (magic, number of dice, number
+# of sides, number of hands) followed by an array of float64 expected
+# scores and an array of uint32 hold masks, one entry per sorted hand in
+# gen_sorted_outcomes order.  Bit i of a mask means "hold die i of the
+# sorted hand".
+TABLE_MAGIC = "YHTZ"
+TABLE_HEADER = "=4sHHI"
+
+
+def best_hold(hand, num_die_sides):
+    """
+    Like strategy, using expected_value_multiset and breaking ties by
+    the first hold in sorted order.  Returns (expected score, hold).
+    """
+    tohold = tuple()
+    best_expect = -float('inf')
+    for choice in sorted(gen_all_holds_fast(hand)):
+        expected = expected_value_multiset(choice, num_die_sides, len(hand)-len(choice))
+        if expected > best_expect:
+            best_expect = expected
+            tohold = choice
+    return (best_expect, tohold)
+
+
+def hold_to_mask(hand, hold):
+    """
+    Return the bitmask of positions of hold in the sorted hand
+    """
+    mask = 0
+    left = list(hold)
+    for idx in range(len(hand)):
+        if hand[idx] in left:
+            left.remove(hand[idx])
+            mask |= 1 << idx
+    return mask
+
+
+class StrategyTable:
+    """
+    O(1) lookup of the best hold for every sorted hand of num_dice dice
+    with num_die_sides sides.
+    """
+
+    def __init__(self, num_dice, num_die_sides, expected, masks):
+        self._num_dice = num_dice
+        self._num_die_sides = num_die_sides
+        self._expected = expected
+        self._masks = masks
+        self._index = {}
+        self._holds = []
+        hands = gen_sorted_outcomes(num_die_sides, num_dice)
+        for idx in range(len(hands)):
+            hand = hands[idx][0]
+            self._index[hand] = idx
+            self._holds.append(tuple([hand[pos] for pos in range(num_dice)
+                                      if masks[idx] >> pos & 1]))
+
+    def __len__(self):
+        return len(self._holds)
+
+    def get_dice(self):
+        """
+        Return (number of dice, number of sides) the table was built for
+        """
+        return (self._num_dice, self._num_die_sides)
+
+    def lookup(self, hand):
+        """
+        Return (expected score, hold) for hand, in any order
+        """
+        idx = self._index[tuple(sorted(hand))]
+        return (self._expected[idx], self._holds[idx])
+
+    def save(self, filename):
+        """
+        Write the table to a binary file
+        """
+        import struct
+        out_file = open(filename, "wb")
+        out_file.write(struct.pack(TABLE_HEADER, TABLE_MAGIC.encode("ascii"), self._num_dice,
+                                   self._num_die_sides, len(self._holds)))
+        self._expected.tofile(out_file)
+        self._masks.tofile(out_file)
+        out_file.close()
+
+
+def build_strategy_table(num_dice, num_die_sides):
+    """
+    Compute best_hold for every sorted hand and return a StrategyTable
+    """
+    from array import array
+    expected = array('d')
+    masks = array('I')
+    for hand, dummy_weight in gen_sorted_outcomes(num_die_sides, num_dice):
+        hand_expect, hold = best_hold(hand, num_die_sides)
+        expected.append(hand_expect)
+        masks.append(hold_to_mask(hand, hold))
+    return StrategyTable(num_dice, num_die_sides, expected, masks)
+
+
+def load_strategy_table(filename):
+    """
+    Read a StrategyTable written by StrategyTable.save
+    """
+    import struct
+    from array import array
+    in_file = open(filename, "rb")
+    magic, num_dice, num_die_sides, count = struct.unpack(
+        TABLE_HEADER, in_file.read(struct.calcsize(TABLE_HEADER)))
+    if magic != TABLE_MAGIC.encode("ascii"):
+        in_file.close()
+        raise ValueError("not a strategy table: " + filename)
+    expected = array('d')
+    masks = array('I')
+    expected.fromfile(in_file, count)
+    masks.fromfile(in_file, count)
+    in_file.close()
+    return StrategyTable(num_dice, num_die_sides, expected, masks)
+
+
+def load_or_build_strategy_table(filename, num_dice, num_die_sides):
+    """
+    Load the table from filename, building and saving it first if the
+    file is missing or was built for other dice
+    """
+    import struct
+    try:
+        table = load_strategy_table(filename)
+        if table.get_dice() == (num_dice, num_die_sides):
+            return table
+    except (IOError, ValueError, EOFError, struct.error):
+        pass
+    table = build_strategy_table(num_dice, num_die_sides)
+    table.save(filename)
+    return table
+
+# Full-turn planner.
+def plan_holds(task):
+    """
+    Worker for RollPlanner.build_tables: task is (num_dice,
+    num_die_sides, score_function, rolls_left, holds, hand_table), where
+    hand_table maps (hand, rolls_left - 1) to (expected score, hold) for
+    every hand.  Returns a list of ((held, rolls_left), expected score)
+    entries, one per hold.
+    """
+    num_dice, num_die_sides, score_function, rolls_left, holds, hand_table = task
+    planner = RollPlanner(num_dice, num_die_sides, score_function)
+    planner.add_hand_values(hand_table)
+    return [((held, rolls_left), planner.roll_value(held, rolls_left)) for held in holds]
+
+
+class RollPlanner:
+    """
+    Optimal holds over a whole turn of rolls (the first roll of all dice
+    plus rolls - 1 rerolls), scored by score_function on the final hand.
+    Expected values are memoized on (sorted held dice, rolls left).
+    score_function must be a module-level function to use a process pool.
+    """
+
+    def __init__(self, num_dice, num_die_sides, score_function = score, rolls = 3):
+        self._num_dice = num_dice
+        self._num_die_sides = num_die_sides
+        self._score_function = score_function
+        self._rolls = rolls
+        self._roll_memo = {}
+        self._hand_memo = {}
+
+    def roll_value(self, held, rolls_left):
+        """
+        Expected final score of holding the sorted dice held and rolling
+        the rest, with rolls_left rolls remaining including this one
+        """
+        key = (held, rolls_left)
+        if key not in self._roll_memo:
+            free = self._num_dice - len(held)
+            total = 0.0
+            for outcome, weight in gen_sorted_outcomes(self._num_die_sides, free):
+                hand = tuple(sorted(held + outcome))
+                total += weight * self.hand_value(hand, rolls_left - 1)[0]
+            self._roll_memo[key] = total / self._num_die_sides ** free
+        return self._roll_memo[key]
+
+    def hand_value(self, hand, rerolls_left):
+        """
+        Return (expected final score, hold) for a sorted hand with
+        rerolls_left rerolls left.  With none left the whole hand is kept.
+        """
+        key = (hand, rerolls_left)
+        if key not in self._hand_memo:
+            if rerolls_left == 0:
+                self._hand_memo[key] = (float(self._score_function(hand)), hand)
+            else:
+                best_expect = -float('inf')
+                tohold = hand
+                for choice in sorted(gen_all_holds_fast(hand)):
+                    if len(choice) == len(hand):
+                        expected = self.hand_value(hand, rerolls_left - 1)[0]
+                    else:
+                        expected = self.roll_value(choice, rerolls_left)
+                    if expected > best_expect:
+                        best_expect = expected
+                        tohold = choice
+                self._hand_memo[key] = (best_expect, tohold)
+        return self._hand_memo[key]
+
+    def turn_value(self):
+        """
+        Expected score of a whole turn played optimally
+        """
+        return self.roll_value((), self._rolls)
+
+    def best_hold(self, hand, rerolls_left):
+        """
+        Return (expected final score, hold) for hand in any order
+        """
+        return self.hand_value(tuple(sorted(hand)), rerolls_left)
+
+    def add_hand_values(self, hand_table):
+        """
+        Seed the memo with (hand, rerolls_left) -> (expected score, hold)
+        entries
+        """
+        self._hand_memo.update(hand_table)
+
+    def build_tables(self, pool = None, chunks = 8):
+        """
+        Fill the decision table for every hand and number of rerolls,
+        one level of rerolls at a time: the expected value of every
+        proper hold is split into chunks and computed through pool.map
+        (e.g. a multiprocessing.Pool), or serially without a pool, from
+        the previous level's hand values, then every hand picks its best
+        hold from those.  Returns the number of (hand, rerolls) decisions.
+        """
+        hands = [hand for hand, dummy_weight in
+                 gen_sorted_outcomes(self._num_die_sides, self._num_dice)]
+        holds = [held for length in range(self._num_dice) for held, dummy_weight in
+                 gen_sorted_outcomes(self._num_die_sides, length)]
+        hand_table = {}
+        count = 0
+        for rolls_left in range(1, self._rolls):
+            tasks = [(self._num_dice, self._num_die_sides, self._score_function, rolls_left,
+                      holds[idx::chunks], hand_table) for idx in range(chunks)]
+            if pool == None:
+                results = [plan_holds(task) for task in tasks]
+            else:
+                results = pool.map(plan_holds, tasks)
+            for chunk in results:
+                self._roll_memo.update(chunk)
+            hand_table = {}
+            for hand in hands:
+                hand_table[(hand, rolls_left)] = self.hand_value(hand, rolls_left)
+                count += 1
+        return count
+
 
 def run_example():
     """
@@ -116,6 +466,7 @@ def run_example():
     
     
 #run_example()
+#benchmark_holds()
 
 
 #import poc_holds_testsuite
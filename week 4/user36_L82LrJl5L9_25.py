@@ -3,8 +3,9 @@ Student portion of Zombie Apocalypse mini-project
 """
 
 import random
+import heapq
+import time
 import poc_grid
-import poc_queue
 import poc_zombie_gui
 
 # global constants
@@ -16,6 +17,19 @@ OBSTACLE = "obstacle"
 HUMAN = "human"
 ZOMBIE = "zombie"
 
+# Trace files written by Zombie.run (native byte order): header of magic,
+# grid height, grid width and obstacle count, then the obstacle cells as
+# int32 (row, col) pairs, then per snapshot the human and zombie counts
+# followed by their int32 (row, col) pairs, humans first.
+TRACE_MAGIC = "ZTRC"
+TRACE_HEADER = "=4sIII"
+TRACE_COUNTS = "=II"
+
+# (row, col) offsets in the order of poc_grid's four_neighbors and
+# eight_neighbors, which decides ties when moving
+FOUR_OFFSETS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+EIGHT_OFFSETS = FOUR_OFFSETS + ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
 
 class Zombie(poc_grid.Grid):
     """
@@ -30,6 +44,21 @@ class Zombie(poc_grid.Grid):
         humans, and zombies
         """
         poc_grid.Grid.__init__(self, grid_height, grid_width)
+        # flat row-major copy of the obstacle grid, and a BFS queue
+        # buffer reused by compute_distance_field_flat
+        self._blocked = [False] * (grid_height * grid_width)
+        self._bfs_queue = [0] * (grid_height * grid_width)
+        # per-cell cost of entering a cell (see set_weight), the number
+        # of cells whose weight is not 1, and the neighborhood used for
+        # distance fields
+        self._weights = [1] * (grid_height * grid_width)
+        self._heavy_cells = 0
+        self._distance_type = FOUR_WAY
+        # state for update_distance_field: the last field and source
+        # counts per entity type, and obstacle edits not yet applied
+        self._fields = {}
+        self._pending_cells = {ZOMBIE: set(), HUMAN: set()}
+        self._touched = {}
         if obstacle_list != None:
             for cell in obstacle_list:
                 self.set_full(cell[0], cell[1])
@@ -48,8 +77,73 @@ class Zombie(poc_grid.Grid):
         Reset zombie and human lists to be empty
         """
         poc_grid.Grid.clear(self)
+        self._blocked = [False] * (self.get_grid_height() * self.get_grid_width())
+        self._weights = [1] * (self.get_grid_height() * self.get_grid_width())
+        self._heavy_cells = 0
+        self._fields = {}
+        self._pending_cells = {ZOMBIE: set(), HUMAN: set()}
         self._zombie_list = []
         self._human_list = []
+
+    def set_full(self, row, col):
+        """
+        Set cell to be an obstacle
+        """
+        poc_grid.Grid.set_full(self, row, col)
+        self._obstacle_changed(row * self.get_grid_width() + col, True)
+
+    def set_empty(self, row, col):
+        """
+        Set cell to be free of obstacles
+        """
+        poc_grid.Grid.set_empty(self, row, col)
+        self._obstacle_changed(row * self.get_grid_width() + col, False)
+
+    def _obstacle_changed(self, idx, full):
+        """
+        Update the flat obstacle grid and remember the edit for
+        update_distance_field
+        """
+        if self._blocked[idx] != full:
+            self._blocked[idx] = full
+            for cells in self._pending_cells.values():
+                cells.add(idx)
+
+    def set_weight(self, row, col, weight):
+        """
+        Set the cost of moving into a cell to a positive integer
+        (default 1)
+        """
+        if weight < 1 or weight != int(weight):
+            raise ValueError("cell weight must be a positive integer")
+        idx = row * self.get_grid_width() + col
+        old_weight = self._weights[idx]
+        if old_weight != weight:
+            self._heavy_cells += (weight != 1) - (old_weight != 1)
+            self._weights[idx] = int(weight)
+            self._fields = {}
+
+    def get_weight(self, row, col):
+        """
+        Return the cost of moving into a cell
+        """
+        return self._weights[row * self.get_grid_width() + col]
+
+    def set_distance_type(self, distance_type):
+        """
+        Use FOUR_WAY or EIGHT_WAY neighbors for distance fields
+        """
+        if distance_type not in (FOUR_WAY, EIGHT_WAY):
+            raise ValueError("distance_type must be FOUR_WAY or EIGHT_WAY")
+        if distance_type != self._distance_type:
+            self._distance_type = distance_type
+            self._fields = {}
+
+    def get_distance_type(self):
+        """
+        Return the neighborhood used for distance fields
+        """
+        return self._distance_type
         
     def add_zombie(self, row, col):
         """
@@ -96,38 +190,323 @@ class Zombie(poc_grid.Grid):
         Distance at member of entity_queue is zero
         Shortest paths avoid obstacles and use distance_type distances
         """
-        visited = poc_grid.Grid(self.get_grid_height(), self.get_grid_width())
-        distance_field = [[self.get_grid_height()*self.get_grid_width() for dummy_col in range(self.get_grid_width())]
-                       for dummy_row in range(self.get_grid_height())]
-        boundary = poc_queue.Queue()
+        flat_field = self.compute_distance_field_flat(entity_type)
+        width = self.get_grid_width()
+        return [flat_field[row * width:(row + 1) * width] for row in range(self.get_grid_height())]
+
+    def compute_distance_field_flat(self, entity_type):
+        """
+        Same distance field as compute_distance_field, as a flat
+        row-major list (cell (row, col) at row * width + col).
+        Unreachable cells hold height * width times the largest cell
+        weight, which no path can reach.  Uses breadth-first search
+        when every weight is 1 and _weighted_distance_field otherwise.
+        """
+        if self._heavy_cells != 0:
+            return self._weighted_distance_field(entity_type)
+        eight_way = self._distance_type == EIGHT_WAY
+        height = self.get_grid_height()
+        width = self.get_grid_width()
+        size = height * width
+        unreached = size
+        field = [unreached] * size
+        blocked = self._blocked
+        # every cell is queued at most once, so the buffer never wraps
+        queue = self._bfs_queue
+        tail = 0
+        if entity_type == ZOMBIE:
+            sources = self._zombie_list
+        else:
+            sources = self._human_list
+        for row, col in sources:
+            idx = row * width + col
+            if field[idx] != 0:
+                field[idx] = 0
+                queue[tail] = idx
+                tail += 1
+        head = 0
+        last_row = size - width
+        while head < tail:
+            idx = queue[head]
+            head += 1
+            dist = field[idx] + 1
+            col = idx % width
+            if idx >= width:
+                nbr = idx - width
+                if field[nbr] == unreached and not blocked[nbr]:
+                    field[nbr] = dist
+                    queue[tail] = nbr
+                    tail += 1
+            if idx < last_row:
+                nbr = idx + width
+                if field[nbr] == unreached and not blocked[nbr]:
+                    field[nbr] = dist
+                    queue[tail] = nbr
+                    tail += 1
+            if col > 0:
+                nbr = idx - 1
+                if field[nbr] == unreached and not blocked[nbr]:
+                    field[nbr] = dist
+                    queue[tail] = nbr
+                    tail += 1
+            if col < width - 1:
+                nbr = idx + 1
+                if field[nbr] == unreached and not blocked[nbr]:
+                    field[nbr] = dist
+                    queue[tail] = nbr
+                    tail += 1
+            if eight_way:
+                if idx >= width and col > 0:
+                    nbr = idx - width - 1
+                    if field[nbr] == unreached and not blocked[nbr]:
+                        field[nbr] = dist
+                        queue[tail] = nbr
+                        tail += 1
+                if idx >= width and col < width - 1:
+                    nbr = idx - width + 1
+                    if field[nbr] == unreached and not blocked[nbr]:
+                        field[nbr] = dist
+                        queue[tail] = nbr
+                        tail += 1
+                if idx < last_row and col > 0:
+                    nbr = idx + width - 1
+                    if field[nbr] == unreached and not blocked[nbr]:
+                        field[nbr] = dist
+                        queue[tail] = nbr
+                        tail += 1
+                if idx < last_row and col < width - 1:
+                    nbr = idx + width + 1
+                    if field[nbr] == unreached and not blocked[nbr]:
+                        field[nbr] = dist
+                        queue[tail] = nbr
+                        tail += 1
+        return field
+
+    def _weighted_distance_field(self, entity_type):
+        """
+        Dial's algorithm for compute_distance_field_flat: Dijkstra with
+        a circular array of max_weight + 1 buckets indexed by distance,
+        where a path's cost is the sum of the weights of the cells it
+        enters.
+        """
+        width = self.get_grid_width()
+        size = self.get_grid_height() * width
+        weights = self._weights
+        blocked = self._blocked
+        max_weight = max(weights)
+        num_buckets = max_weight + 1
+        unreached = size * max_weight
+        field = [unreached] * size
+        buckets = [[] for dummy_bucket in range(num_buckets)]
         if entity_type == ZOMBIE:
-            for item in self._zombie_list:
-                boundary.enqueue(item)
-        elif entity_type == HUMAN:
-            for item in self._human_list:
-                boundary.enqueue(item)
-        for cells in boundary:
-            visited.set_full(cells[0], cells[1])
-            distance_field[cells[0]][cells[1]] = EMPTY
-        while len(boundary) > 0:
-            current_cell = boundary.dequeue()
-            neighbors = self.four_neighbors(current_cell[0], current_cell[1])
-            for neighbor_cell in neighbors:
-                if visited.is_empty(neighbor_cell[0], neighbor_cell[1]) and self.is_empty(neighbor_cell[0], neighbor_cell[1]):
-                    # both visited and self should be checked
-                    visited.set_full(neighbor_cell[0], neighbor_cell[1])
-                    boundary.enqueue(neighbor_cell)
-                    distance_field[neighbor_cell[0]][neighbor_cell[1]] = min(distance_field[neighbor_cell[0]][neighbor_cell[1]], 
-                                                                             distance_field[current_cell[0]][current_cell[1]] + 1) 
-        return distance_field
+            sources = self._zombie_list
+        else:
+            sources = self._human_list
+        pending = 0
+        for row, col in sources:
+            idx = row * width + col
+            if field[idx] != 0:
+                field[idx] = 0
+                buckets[0].append(idx)
+                pending += 1
+        dist = 0
+        while pending > 0:
+            # a cell pushed from this bucket lands at least one and at
+            # most max_weight buckets further on, never back in this one
+            bucket = buckets[dist % num_buckets]
+            while bucket != []:
+                idx = bucket.pop()
+                pending -= 1
+                if field[idx] != dist:
+                    continue
+                for nbr in self._flat_neighbors(idx):
+                    new_dist = dist + weights[nbr]
+                    if new_dist < field[nbr] and not blocked[nbr]:
+                        field[nbr] = new_dist
+                        buckets[new_dist % num_buckets].append(nbr)
+                        pending += 1
+            dist += 1
+        return field
+
+    def _flat_neighbors(self, idx):
+        """
+        Return the flat indices of the four (or with EIGHT_WAY, eight)
+        neighbors of cell idx
+        """
+        width = self.get_grid_width()
+        col = idx % width
+        has_up = idx >= width
+        has_down = idx < len(self._blocked) - width
+        ans = []
+        if has_up:
+            ans.append(idx - width)
+        if has_down:
+            ans.append(idx + width)
+        if col > 0:
+            ans.append(idx - 1)
+        if col < width - 1:
+            ans.append(idx + 1)
+        if self._distance_type == EIGHT_WAY:
+            if has_up and col > 0:
+                ans.append(idx - width - 1)
+            if has_up and col < width - 1:
+                ans.append(idx - width + 1)
+            if has_down and col > 0:
+                ans.append(idx + width - 1)
+            if has_down and col < width - 1:
+                ans.append(idx + width + 1)
+        return ans
+
+    def update_distance_field(self, entity_type):
+        """
+        Incremental version of compute_distance_field_flat.  The field
+        from the previous call for entity_type is repaired in place for
+        the entities and obstacles that changed since, touching only the
+        affected cells; the returned list is reused by the next call.
+        The field is recomputed from scratch instead if any cell weight
+        is not 1, if more than a quarter of the source cells changed (a
+        moved source invalidates most of its own region, so the repair
+        would cost more than a BFS), or once the repair touches more
+        than an eighth of the grid.  last_update_touched reports how
+        many cells were touched.
+        """
+        if entity_type == ZOMBIE:
+            source_list = self._zombie_list
+        else:
+            source_list = self._human_list
+        sources = {}
+        for row, col in source_list:
+            idx = row * self.get_grid_width() + col
+            sources[idx] = sources.get(idx, 0) + 1
+        cached = self._fields.get(entity_type)
+        changed_cells = self._pending_cells[entity_type]
+        self._pending_cells[entity_type] = set()
+        if cached != None and self._heavy_cells == 0:
+            field, old_sources = cached
+            added = [idx for idx in sources if idx not in old_sources]
+            removed = [idx for idx in old_sources if idx not in sources]
+            touched = None
+            if 4 * (len(added) + len(removed)) <= len(sources) + len(old_sources):
+                touched = self._repair_field(field, sources, added, removed, changed_cells,
+                                             len(field) // 8)
+            if touched != None:
+                self._fields[entity_type] = (field, sources)
+                self._touched[entity_type] = touched
+                return field
+            field[:] = self.compute_distance_field_flat(entity_type)
+        else:
+            field = self.compute_distance_field_flat(entity_type)
+        self._fields[entity_type] = (field, sources)
+        self._touched[entity_type] = len(field)
+        return field
+
+    def _repair_field(self, field, sources, added, removed, changed_cells, budget):
+        """
+        Repair field after sources were added/removed and obstacles
+        changed, and return the number of cells touched, or None (with
+        field left inconsistent) once more than budget cells have been
+        touched.  A non-source cell's distance is 1 + the smallest
+        distance of its neighbors, and obstacles that are not sources
+        are unreachable.
+        """
+        blocked = self._blocked
+        unreached = len(field)
+        width = self.get_grid_width()
+        steps = self._neighbor_steps()
+        touched = 0
+        # raise phase: drop every cell that lost all of its supporting
+        # neighbors, rechecking the dependents of each dropped cell
+        invalid = []
+        check = list(removed) + [idx for idx in changed_cells if blocked[idx]]
+        while check != []:
+            idx = check.pop()
+            touched += 1
+            if touched > budget:
+                return None
+            old_dist = field[idx]
+            if idx in sources or old_dist == unreached:
+                continue
+            col = idx % width
+            if not blocked[idx]:
+                supported = False
+                for delta, dcol in steps:
+                    nbr = idx + delta
+                    if (0 <= nbr < unreached and 0 <= col + dcol < width and
+                            field[nbr] == old_dist - 1):
+                        supported = True
+                        break
+                if supported:
+                    continue
+            field[idx] = unreached
+            invalid.append(idx)
+            for delta, dcol in steps:
+                nbr = idx + delta
+                if (0 <= nbr < unreached and 0 <= col + dcol < width and
+                        field[nbr] == old_dist + 1):
+                    check.append(nbr)
+        # lower phase: reseed from new sources, freed cells and the edge
+        # of the dropped region, then relax outwards in distance order
+        heap = []
+        for idx in added:
+            field[idx] = 0
+            heap.append((0, idx))
+        for idx in invalid + [idx for idx in changed_cells if not blocked[idx]]:
+            if blocked[idx] or idx in sources:
+                continue
+            best = unreached
+            col = idx % width
+            for delta, dcol in steps:
+                nbr = idx + delta
+                if (0 <= nbr < unreached and 0 <= col + dcol < width and
+                        field[nbr] + 1 < best):
+                    best = field[nbr] + 1
+            if best < field[idx]:
+                field[idx] = best
+                heap.append((best, idx))
+        heapq.heapify(heap)
+        while heap != []:
+            dist, idx = heapq.heappop(heap)
+            touched += 1
+            if touched > budget:
+                return None
+            if dist > field[idx]:
+                continue
+            col = idx % width
+            for delta, dcol in steps:
+                nbr = idx + delta
+                if (0 <= nbr < unreached and 0 <= col + dcol < width and
+                        dist + 1 < field[nbr] and not blocked[nbr]):
+                    field[nbr] = dist + 1
+                    heapq.heappush(heap, (dist + 1, nbr))
+        return touched
+
+    def _neighbor_steps(self):
+        """
+        Return (flat index delta, column delta) for each neighbor under
+        the current distance type; a step from cell idx in column col is
+        on the grid if idx + delta and col + column delta are in range
+        """
+        width = self.get_grid_width()
+        if self._distance_type == EIGHT_WAY:
+            offsets = EIGHT_OFFSETS
+        else:
+            offsets = FOUR_OFFSETS
+        return [(drow * width + dcol, dcol) for drow, dcol in offsets]
+
+    def last_update_touched(self, entity_type):
+        """
+        Return the number of cells touched by the last
+        update_distance_field call for entity_type
+        """
+        return self._touched.get(entity_type, 0)
+
     
     def move_humans(self, zombie_distance):
         """
         Function that moves humans away from zombies, diagonal moves
         are allowed
         """
-        for human in self._human_list:
-            index = self._human_list.index(human)
+        for index, human in enumerate(self._human_list):
             distance_max = zombie_distance[human[0]][human[1]]
             neighbors = self.eight_neighbors(human[0], human[1])
             for neighbor in neighbors:       
@@ -141,8 +520,7 @@ class Zombie(poc_grid.Grid):
         Function that moves zombies towards humans, no diagonal moves
         are allowed
         """
-        for zombie in self._zombie_list:
-            index = self._zombie_list.index(zombie)
+        for index, zombie in enumerate(self._zombie_list):
             distance_min = human_distance[zombie[0]][zombie[1]]
             neighbors = self.four_neighbors(zombie[0], zombie[1])
             for neighbor in neighbors:       
@@ -150,6 +528,205 @@ class Zombie(poc_grid.Grid):
                     distance_min = human_distance[neighbor[0]][neighbor[1]]                    
                     self._zombie_list[index] = neighbor
 
+    def _padded_keys(self, flat_field, border):
+        """
+        Return (keys, pad_width): flat_field * 16 laid out row-major in a
+        grid with a one-cell border holding border * 16, so that
+        neighbors can be gathered without bounds checks.  The low four
+        bits are left free for the index of the offset being tried.
+        """
+        height = self.get_grid_height()
+        width = self.get_grid_width()
+        pad_width = width + 2
+        border *= 16
+        keys = [border] * (pad_width + 1)
+        for row in range(height):
+            keys.extend([dist * 16 for dist in flat_field[row * width:(row + 1) * width]])
+            keys.extend((border, border))
+        keys.extend([border] * (pad_width - 1))
+        return keys, pad_width
+
+    def move_humans_flat(self, zombie_field):
+        """
+        move_humans for a flat field from compute_distance_field_flat
+        or update_distance_field.  Each human's choice is one max over
+        keys dist * 16 + k, where k is 0 for staying and 1 + the index
+        into EIGHT_OFFSETS otherwise, which keeps move_humans' rule that
+        the last of the farthest neighbors wins.
+        """
+        keys, pad_width = self._padded_keys(zombie_field, -1)
+        up, down, left, right, up_left, up_right, down_left, down_right = [
+            drow * pad_width + dcol for drow, dcol in EIGHT_OFFSETS]
+        cells = [(row + 1) * pad_width + col + 1 for row, col in self._human_list]
+        best = [max(keys[idx], keys[idx + up] + 1, keys[idx + down] + 2,
+                    keys[idx + left] + 3, keys[idx + right] + 4,
+                    keys[idx + up_left] + 5, keys[idx + up_right] + 6,
+                    keys[idx + down_left] + 7, keys[idx + down_right] + 8)
+                for idx in cells]
+        drows = [0] + [drow for drow, dummy_dcol in EIGHT_OFFSETS]
+        dcols = [0] + [dcol for dummy_drow, dcol in EIGHT_OFFSETS]
+        self._human_list = [(row + drows[key & 15], col + dcols[key & 15])
+                            for (row, col), key in zip(self._human_list, best)]
+
+    def move_zombies_flat(self, human_field):
+        """
+        move_zombies for a flat field from compute_distance_field_flat
+        or update_distance_field: one min over keys dist * 16 + 4 - k,
+        with k as in move_humans_flat over FOUR_OFFSETS
+        """
+        keys, pad_width = self._padded_keys(human_field, max(human_field) + 1)
+        up, down, left, right = [drow * pad_width + dcol for drow, dcol in FOUR_OFFSETS]
+        cells = [(row + 1) * pad_width + col + 1 for row, col in self._zombie_list]
+        best = [min(keys[idx] + 4, keys[idx + up] + 3, keys[idx + down] + 2,
+                    keys[idx + left] + 1, keys[idx + right])
+                for idx in cells]
+        drows = [drow for drow, dummy_dcol in FOUR_OFFSETS][::-1] + [0]
+        dcols = [dcol for dummy_drow, dcol in FOUR_OFFSETS][::-1] + [0]
+        self._zombie_list = [(row + drows[key & 15], col + dcols[key & 15])
+                             for (row, col), key in zip(self._zombie_list, best)]
+
+    def run(self, ticks, trace_file = None, incremental = False):
+        """
+        Run the simulation headless for the given number of ticks, in
+        the same order as the GUI: zombie field, move humans, human
+        field, move zombies.  Returns the total seconds spent in each
+        phase.  If trace_file is given, the obstacles and the entity
+        positions before the first tick and after every tick are
+        written to it (see read_trace).  Fields are flat and entities
+        move with move_humans_flat / move_zombies_flat; with incremental
+        set the fields come from update_distance_field.
+        """
+        timings = {"zombie_field": 0.0, "move_humans": 0.0,
+                   "human_field": 0.0, "move_zombies": 0.0}
+        out_file = None
+        if trace_file != None:
+            out_file = open(trace_file, "wb")
+            self._write_trace_header(out_file)
+            self._write_trace_snapshot(out_file)
+        for dummy_tick in range(ticks):
+            start = time.time()
+            zombie_distance = self._flat_field(ZOMBIE, incremental)
+            phase_end = time.time()
+            timings["zombie_field"] += phase_end - start
+            start = phase_end
+            self.move_humans_flat(zombie_distance)
+            phase_end = time.time()
+            timings["move_humans"] += phase_end - start
+            start = phase_end
+            human_distance = self._flat_field(HUMAN, incremental)
+            phase_end = time.time()
+            timings["human_field"] += phase_end - start
+            start = phase_end
+            self.move_zombies_flat(human_distance)
+            timings["move_zombies"] += time.time() - start
+            if out_file != None:
+                self._write_trace_snapshot(out_file)
+        if out_file != None:
+            out_file.close()
+        return timings
+
+    def _flat_field(self, entity_type, incremental):
+        """
+        Return the flat distance field used by run
+        """
+        if incremental:
+            return self.update_distance_field(entity_type)
+        return self.compute_distance_field_flat(entity_type)
+
+    def _write_trace_header(self, out_file):
+        """
+        Write the trace header: magic, grid size and obstacle cells
+        """
+        import struct
+        from array import array
+        obstacles = array('i')
+        for row in range(self.get_grid_height()):
+            for col in range(self.get_grid_width()):
+                if not self.is_empty(row, col):
+                    obstacles.append(row)
+                    obstacles.append(col)
+        out_file.write(struct.pack(TRACE_HEADER, TRACE_MAGIC.encode("ascii"), self.get_grid_height(),
+                                   self.get_grid_width(), len(obstacles) // 2))
+        obstacles.tofile(out_file)
+
+    def _write_trace_snapshot(self, out_file):
+        """
+        Write the current human and zombie positions to the trace
+        """
+        import struct
+        from array import array
+        out_file.write(struct.pack(TRACE_COUNTS, len(self._human_list), len(self._zombie_list)))
+        positions = array('i')
+        for entity_list in (self._human_list, self._zombie_list):
+            for row, col in entity_list:
+                positions.append(row)
+                positions.append(col)
+        positions.tofile(out_file)
+
+
+def read_trace(filename):
+    """
+    Read a trace written by Zombie.run and return (grid_height,
+    grid_width, obstacle_list, snapshots), where snapshots is a list of
+    (human_list, zombie_list) pairs, one per tick plus the start.
+    """
+    import struct
+    from array import array
+    in_file = open(filename, "rb")
+    magic, grid_height, grid_width, num_obstacles = struct.unpack(
+        TRACE_HEADER, in_file.read(struct.calcsize(TRACE_HEADER)))
+    if magic != TRACE_MAGIC.encode("ascii"):
+        in_file.close()
+        raise ValueError("not a zombie trace: " + filename)
+    obstacles = array('i')
+    obstacles.fromfile(in_file, 2 * num_obstacles)
+    obstacle_list = list(zip(obstacles[0::2], obstacles[1::2]))
+    snapshots = []
+    counts_size = struct.calcsize(TRACE_COUNTS)
+    while True:
+        counts = in_file.read(counts_size)
+        if len(counts) < counts_size:
+            break
+        num_humans, num_zombies = struct.unpack(TRACE_COUNTS, counts)
+        positions = array('i')
+        positions.fromfile(in_file, 2 * (num_humans + num_zombies))
+        cells = list(zip(positions[0::2], positions[1::2]))
+        snapshots.append((cells[:num_humans], cells[num_humans:]))
+    in_file.close()
+    return grid_height, grid_width, obstacle_list, snapshots
+
+
+class ReplayZombie(Zombie):
+    """
+    Zombie simulation that replays a trace written by Zombie.run:
+    each move_humans / move_zombies call loads the next snapshot instead
+    of moving, so poc_zombie_gui.run_gui(ReplayZombie(filename)) shows
+    the recorded run.
+    """
+
+    def __init__(self, filename):
+        grid_height, grid_width, obstacle_list, snapshots = read_trace(filename)
+        self._snapshots = snapshots
+        self._tick = 0
+        Zombie.__init__(self, grid_height, grid_width, obstacle_list,
+                        snapshots[0][1], snapshots[0][0])
+
+    def move_humans(self, zombie_distance):
+        """
+        Load the humans of the next snapshot
+        """
+        if self._tick + 1 < len(self._snapshots):
+            self._human_list = list(self._snapshots[self._tick + 1][0])
+
+    def move_zombies(self, human_distance):
+        """
+        Load the zombies of the next snapshot and advance
+        """
+        if self._tick + 1 < len(self._snapshots):
+            self._tick += 1
+            self._zombie_list = list(self._snapshots[self._tick][1])
+
+
 # Start up gui for simulation - You will need to write some code above
 # before this will work without errors
 